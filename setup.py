@@ -168,7 +168,7 @@ setup(
     # If there are data files included in your packages that need to be
     # installed, specify them here.
     package_data={  # Optional
-        'objdictgen': ['config/*.prf', 'schema/*.json'],
+        'objdictgen': ['config/*.prf', 'config/*.prf.json', 'schema/*.json'],
     },
 
     # Although 'package_data' is the preferred approach, in some case you may
@@ -36,7 +36,15 @@ odgdir = os.environ.get('ODG_PROFILE_DIR')
 if odgdir:
     PROFILE_DIRECTORIES.append(odgdir)
 
+# Directory for the compiled profile cache. Disabled when None
+PROFILE_CACHE_DIRECTORY = os.environ.get('ODG_CACHE_DIR') or None
+
+# JSON module used for parsing and compact output, e.g. "json" or "orjson".
+# The first installed of jsonod.JSON_BACKENDS is used when None
+JSON_BACKEND = os.environ.get('ODG_JSON_BACKEND') or None
+
 JSON_SCHEMA = os.path.join(SCRIPT_DIRECTORY, 'schema', 'od.schema.json')
+JSON_PROFILE_SCHEMA = os.path.join(SCRIPT_DIRECTORY, 'schema', 'profile.schema.json')
 
 __all__ = [
     "Node",
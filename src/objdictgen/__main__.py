@@ -18,12 +18,12 @@
 
 from __future__ import absolute_import
 from pprint import pformat
+import os
 import sys
 import getopt
 import argparse
 import functools
 import logging
-import attr
 from colorama import init, Fore, Style
 
 import objdictgen
@@ -38,10 +38,11 @@ log.setLevel(logging.INFO)
 log.addHandler(logging.StreamHandler(sys.stdout))
 
 
-@attr.s
 class DebugOpts(object):
     ''' Options for main to control the debug_wrapper '''
-    show_debug = attr.ib(default=False)
+
+    def __init__(self, show_debug=False):
+        self.show_debug = show_debug
 
     def set_debug(self, dbg):
         self.show_debug = dbg
@@ -159,7 +160,7 @@ def main(debugopts, args=None):
     subp.add_argument('-x', '--exclude', action="append", help="OD Index to exclude.")
     subp.add_argument('-f', '--fix', action="store_true",
                       help="Fix any inconsistency errors in OD before generate output")
-    subp.add_argument('-t', '--type', choices=['od', 'eds', 'json', 'c'], help="Select output file type")
+    subp.add_argument('-t', '--type', choices=['od', 'eds', 'json', 'odb', 'c'], help="Select output file type")
     subp.add_argument('--drop-unused', action="store_true", help="Remove unused parameters")
     subp.add_argument('--internal', action="store_true", help="Store in internal format (json only)")
     subp.add_argument('--nosort', action="store_true", help="Don't order of parameters in output OD")
@@ -174,7 +175,7 @@ def main(debugopts, args=None):
     subp.add_argument('od1', **opt_od)
     subp.add_argument('od2', **opt_od)
     subp.add_argument('--internal', action="store_true", help="Diff internal object")
-    subp.add_argument('--novalidate', action="store_true", help="Don't validate input files before diff")
+    subp.add_argument('--novalidate', action="store_true", help="Don't validate the ODs before diff. JSON files are still checked against the schema")
     subp.add_argument('--show', action="store_true", help="Show difference data")
     subp.add_argument('-D', '--debug', **opt_debug)
 
@@ -214,6 +215,14 @@ def main(debugopts, args=None):
     subp.add_argument('dir', nargs="?", help="Project directory")
     subp.add_argument('-D', '--debug', **opt_debug)
 
+    # -- PROFILE --
+    subp = subparser.add_parser('profile', help='''
+        Convert .prf profile to JSON profile
+    ''')
+    subp.add_argument('prf', help="Profile file")
+    subp.add_argument('out', nargs="?", default=None, help="Output file (default: profile file with .json appended)")
+    subp.add_argument('-D', '--debug', **opt_debug)
+
 
     # -- COMMON --
 
@@ -387,6 +396,16 @@ def main(debugopts, args=None):
         _main(opts.dir)
 
 
+    # -- PROFILE command --
+    elif opts.command == "profile":
+
+        # Always read the .prf file, even if there is a JSON profile for it
+        mapping, menuentries = objdictgen.node.ExecProfile(os.path.abspath(opts.prf))
+        name = os.path.basename(opts.prf).split('.')[0]
+        with open(opts.out or opts.prf + ".json", "w") as f:
+            f.write(jsonod.GenerateProfileJson(mapping, menuentries, name=name))
+
+
     else:
         parser.error("Programming error: Uknown option '%s'" % (opts.command))
 
@@ -568,9 +568,9 @@ def GenerateFileContent(node, filepath):
             subtext = ""
             # Reset number of subindex defined
             nb_subentry = 0
-            for subentry, value in enumerate(values):
-                # Extract the informations of each subindex
-                subentry_infos = node.GetSubentryInfos(entry, subentry)
+            # Extract the informations of each subindex
+            subentries_infos = node.GetSubentryInfosList(entry)
+            for subentry, (value, subentry_infos) in enumerate(zip(values, subentries_infos)):
                 # If entry is not for the compatibility, generate informations for subindex
                 if subentry_infos["name"] != "Compatibility Entry":
                     subtext += "\n[%Xsub%X]\n" % (entry, subentry)
@@ -197,6 +197,7 @@ def GenerateFileContent(node, headerfilepath, pointers_dict=None):
         params_infos = node.GetParamsEntry(index)
         texts["EntryName"] = entry_infos["name"]
         values = node.GetEntry(index)
+        subentries_infos = node.GetSubentryInfosList(index)
         if index in variablelist:
             strindex += "\n/* index 0x%(index)04X :   Mapped variable %(EntryName)s */\n" % texts
         else:
@@ -283,7 +284,7 @@ def GenerateFileContent(node, headerfilepath, pointers_dict=None):
                     texts["subindex"] = subindex
                     params_infos = node.GetParamsEntry(index, subindex)
                     if subindex > 0:
-                        subentry_infos = node.GetSubentryInfos(index, subindex)
+                        subentry_infos = subentries_infos[subindex]
                         typename = GetTypeName(node, subentry_infos["type"])
                         typeinfos = GetValidTypeInfos(context, typename, [values[subindex]])
                         texts["subIndexType"] = typeinfos[0]
@@ -313,8 +314,7 @@ def GenerateFileContent(node, headerfilepath, pointers_dict=None):
         # Generating Dictionary C++ entry
         strindex += "                    subindex %(NodeName)s_Index%(index)04X[] = \n                     {\n" % texts
         generateSubIndexArrayComment = True
-        for subindex, _ in enumerate(values):
-            subentry_infos = node.GetSubentryInfos(index, subindex)
+        for subindex, subentry_infos in enumerate(subentries_infos):
             params_infos = node.GetParamsEntry(index, subindex)
             if subindex < len(values) - 1:
                 sep = ","
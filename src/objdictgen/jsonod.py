@@ -19,13 +19,13 @@
 
 from datetime import datetime
 import sys
+import copy
 import os
 import re
 from collections import OrderedDict
 import logging
 import json
-import jsonschema
-import deepdiff
+from json.encoder import encode_basestring_ascii as encode_json_string
 
 import objdictgen
 from objdictgen import maps
@@ -41,7 +41,9 @@ else:
 log = logging.getLogger('objdictgen')
 
 
-SCHEMA = None
+# Compiled JSON schema validators, by the path, modification time and size of
+# the schema file. See get_schema_validator()
+SCHEMA_VALIDATORS = {}
 
 
 class ValidationError(Exception):
@@ -57,6 +59,11 @@ JSON_DESCRIPTION = "Canfestival object dictionary data"
 JSON_INTERNAL_VERSION = "0"
 JSON_VERSION = "1"
 
+# JSON profile format
+JSON_PROFILE_ID = "od profile"
+JSON_PROFILE_DESCRIPTION = "Canfestival object dictionary profile"
+JSON_PROFILE_VERSION = "1"
+
 # Output order in JSON file
 JSON_TOP_ORDER = (
     "$id", "$version", "$description", "$tool", "$date", "$schema",
@@ -81,6 +88,34 @@ JSON_SUB_ORDER = (
     "default", "value",
 )
 
+# Node members in the top-level dict, as (json key, node member)
+NODE_TOP_FIELDS = (
+    ('name', 'Name'),
+    ('description', 'Description'),
+    ('type', 'Type'),
+    ('id', 'ID'),
+    ('profile', 'ProfileName'),
+    ('default_string_size', 'DefaultStringSize'),
+)
+# Node members that are either in the top-level dict or are not exported
+NODE_MEMBERS = {v for _, v in NODE_TOP_FIELDS} | {
+    'Dictionary', 'ParamsDictionary', 'Profile', 'SpecificMenu',
+    'DS302', 'UserMapping', 'IndexOrder',
+}
+
+# Output order in JSON profile file
+JSON_PROFILE_TOP_ORDER = (
+    "$id", "$version", "$description", "$tool", "$date",
+    "name", "mapping", "menu",
+)
+JSON_PROFILE_ENTRY_ORDER = (
+    "index", "name", "struct", "need", "callback",
+    "incr", "nbmax", "size", "default", "values",
+)
+JSON_PROFILE_SUB_ORDER = (
+    "name", "type", "access", "pdo", "nbmin", "nbmax", "default",
+)
+
 
 # ----------
 # Reverse validation (mem -> dict):
@@ -161,20 +196,72 @@ SUBINDEX0 = {
 }
 
 
+# JSON backends for parsing and compact output, in order of preference. The
+# json module is used when none of them are installed
+JSON_BACKENDS = ('orjson', 'ujson')
+JSON_BACKEND_CACHE = {}
+
+# Fields written as comments and fields annotated with their value by
+# iter_jsonc_chunks()
+RE_JSONC_COMMENT_KEY = re.compile(r'__(\w+)\Z')
+RE_JSONC_SYMBOL = re.compile(r'[a-zA-Z0-9_]+\Z')
+
+# Tokens used by iter_jsonc()
+RE_JSONC_COMMENT = re.compile(r'//|/\*')
+RE_JSONC_STRING = re.compile(r'"[^"\\\n]*(?:\\.[^"\\\n]*)*"')
+RE_JSONC_EOL = re.compile(r'[\r\n]')
+
+
+def iter_jsonc(text):
+    ''' Generate the parts of the jsonc text which are outside comments. The
+        text is scanned once, from one comment to the next. As JSON strings
+        can't span lines, only the strings on the lines before a comment need
+        to be scanned to tell if the comment is within a string. Unterminated
+        comments are left as is.
+    '''
+    start = pos = 0
+    while True:
+        match = RE_JSONC_COMMENT.search(text, pos)
+        if not match:
+            break
+        comment = match.start()
+
+        # Skip the strings which begins before the comment on its line
+        scan = max(pos, text.rfind('\n', pos, comment) + 1)
+        quote = text.find('"', scan, comment)
+        while quote >= 0:
+            match = RE_JSONC_STRING.match(text, quote)
+            if match:
+                scan = match.end()
+            else:
+                # An unterminated string ends at the end of the line
+                scan = text.find('\n', quote)
+                scan = scan if scan >= 0 else len(text)
+            if scan > comment:
+                break
+            quote = text.find('"', scan, comment)
+        if scan > comment:
+            pos = scan
+            continue
+
+        if text[comment + 1] == '/':
+            match = RE_JSONC_EOL.search(text, comment)
+            end = match.start() if match else len(text)
+        else:
+            end = text.find('*/', comment + 2)
+            if end < 0:
+                break
+            end += 2
+        yield text[start:comment]
+        start = pos = end
+    yield text[start:]
+
+
 def remove_jasonc(text):
     ''' Remove jsonc annotations '''
-    # Copied from https://github.com/NickolaiBeloguzov/jsonc-parser/blob/master/jsonc_parser/parser.py#L11-L39
-    def __re_sub(match):
-        if match.group(2) is not None:
-            return ""
-        return match.group(1)
-
-    return re.sub(
-        r"(\".*?\"|\'.*?\')|(/\*.*?\*/|//[^\r\n]*$)",
-        __re_sub,
-        text,
-        flags=re.MULTILINE | re.DOTALL
-    )
+    if '//' not in text and '/*' not in text:
+        return text
+    return ''.join(iter_jsonc(text))
 
 
 def exc_amend(exc, text):
@@ -282,19 +369,13 @@ def member_compare(a, must=None, optional=None, not_want=None, msg='', only_if=N
 def get_object_types(node=None, dictionary=None):
     ''' Return two dicts with the object type mapping '''
 
-    groups = [maps.MAPPING_DICTIONARY]
     if node:
-        groups += node.GetMappings()
+        types = node.GetTypeRegistry()
+    else:
+        types = objdictgen.node.TypeRegistry.Builtin()
 
     # i2s: integer to string, s2i: string to integer
-    i2s, s2i = {}, {}
-    for group in groups:
-        for k, v in group.items():
-            if k >= 0x1000:
-                continue
-            n = v['name']
-            i2s[k] = n
-            s2i[n] = k
+    i2s, s2i = dict(types.ObjectNames), dict(types.ObjectIndexes)
 
     if len(i2s) != len(s2i):
         raise ValidationError("Multiple names or numbers for object types in OD")
@@ -322,8 +403,10 @@ def get_object_types(node=None, dictionary=None):
 def compare_profile(profilename, params, menu=None):
     try:
         dsmap, menumap = objdictgen.ImportProfile(profilename)
-        identical = all(
-            k in dsmap and k in params and dsmap[k] == params[k]
+        # Nodes share the mapping or its entries with the profile, see
+        # Node.ShareProfiles(), which makes the comparison quick
+        identical = params is dsmap or all(
+            k in dsmap and k in params and (dsmap[k] is params[k] or dsmap[k] == params[k])
             for k in set(dsmap) | set(params)
         )
         if menu and not menu == menumap:
@@ -340,6 +423,16 @@ def compare_profile(profilename, params, menu=None):
 
 def GenerateJson(node, compact=False, sort=False, internal=False, validate=True):
     ''' Export a JSON string representation of the node '''
+    return ''.join(GenerateJsonChunks(
+        node, compact=compact, sort=sort, internal=internal, validate=validate
+    ))
+
+
+def GenerateJsonChunks(node, compact=False, sort=False, internal=False, validate=True):
+    ''' Export the JSON representation of the node as an iterator of text
+        chunks, which joined gives the GenerateJson() output. The node is
+        converted and validated before this returns.
+    '''
 
     # Get the dict representation
     jd, objtypes_s2i = node_todict(
@@ -349,80 +442,353 @@ def GenerateJson(node, compact=False, sort=False, internal=False, validate=True)
 
     if compact:
         # Return a compact representation
-        return json.dumps(jd, separators=(',', ':'))
+        return iter([json_dumps_compact(jd)])
 
-    # Generate the json string
-    text = json.dumps(jd, separators=(',', ': '), indent=2)
+    return iter_jsonc_chunks(jd, objtypes_s2i)
 
-    # Convert the special __ fields to jasonc comments
-    out = re.sub(
-        r'^(\s*)"__(\w+)": "(.*)",?$',
-        r'\1// "\2": "\3"',
-        text,
-        flags=re.MULTILINE,
-    )
 
-    # Annotate symbolic fields with comments of the value
-    def _index_repl(m):
-        p = m.group(1)
-        n = v = m.group(2)
-        if p == 'index':
-            n = str_to_number(v)
-        if p == 'type':
-            n = objtypes_s2i.get(v, v)
-        if n != v:
-            return m.group(0) + '  // {}'.format(n)
-        return m.group(0)
-    out = re.sub(  # As object entries
-        r'"(index|type)": "([a-zA-Z0-9_]+)",?$',
-        _index_repl,
-        out,
-        flags=re.MULTILINE,
-    )
-    out = re.sub(  # As comments
-        r'// (index|type): "([a-zA-Z0-9_]+)"',
-        _index_repl,
-        out,
-        flags=re.MULTILINE,
-    )
+def json_key(key):
+    ''' Return the JSON representation of the dict key, as json.dumps() '''
+    if not isinstance(key, (str, unicode)):
+        if not isinstance(key, (int, long, float)) and key is not None:
+            raise TypeError("keys must be str, int, float, bool or None, not %s" % key.__class__.__name__)
+        key = json.dumps(key)
+    return encode_json_string(key)
 
-    return out
 
+def iter_jsonc_chunks(obj, objtypes_s2i, level=0):
+    ''' Generate the rich jsonc text of obj in chunks. The output is the
+        json.dumps() output with an indent of 2, where the "__" fields are
+        turned into comments and the symbolic index and type values are
+        annotated with a comment of their value.
+    '''
+    if isinstance(obj, dict):
+        if not obj:
+            yield '{}'
+            return
+        indent = '\n' + '  ' * (level + 1)
+        last = len(obj) - 1
+        yield '{'
+        for i, (key, value) in enumerate(obj.items()):
+            key = json_key(key)
+            comma = ',' if i < last else ''
+            if not isinstance(value, (str, unicode)):
+                yield indent + key + ': '
+                for chunk in iter_jsonc_chunks(value, objtypes_s2i, level + 1):
+                    yield chunk
+                yield comma
+                continue
 
-def GenerateNode(contents):
-    ''' Import from JSON string or objects '''
+            text = encode_json_string(value)
+            name = key[1:-1]
+            match = RE_JSONC_COMMENT_KEY.match(name)
+            if match:
+                # "__" fields are written as comments, without the comma
+                name = match.group(1)
+                line = indent + '// "' + name + '": ' + text
+            else:
+                line = indent + key + ': ' + text + comma
+
+            # Annotate symbolic fields with comments of the value
+            if name in ('index', 'type') and RE_JSONC_SYMBOL.match(text[1:-1]):
+                symbol = text[1:-1]
+                number = str_to_number(symbol) if name == 'index' else objtypes_s2i.get(symbol, symbol)
+                if number != symbol:
+                    line += '  // {}'.format(number)
+            yield line
+        yield '\n' + '  ' * level + '}'
+
+    elif isinstance(obj, (list, tuple)):
+        if not obj:
+            yield '[]'
+            return
+        indent = '\n' + '  ' * (level + 1)
+        last = len(obj) - 1
+        yield '['
+        for i, value in enumerate(obj):
+            yield indent
+            for chunk in iter_jsonc_chunks(value, objtypes_s2i, level + 1):
+                yield chunk
+            if i < last:
+                yield ','
+        yield '\n' + '  ' * level + ']'
+
+    elif isinstance(obj, (str, unicode)):
+        yield encode_json_string(obj)
 
-    jd = contents
-    if isinstance(contents, str):
+    else:
+        yield json.dumps(obj)
 
-        # Remove jsonc annotations
-        jsontext = remove_jasonc(contents)
 
-        # Load the json, with awareness on ordering in py2
-        if sys.version_info[0] < 3:
-            jd = json.loads(jsontext, object_pairs_hook=ordereddict_hook)
-        else:
-            jd = json.loads(jsontext)
+def GenerateNode(contents, validate=True):
+    ''' Import from JSON string or objects. Set validate to False to skip
+        the validation against the JSON schema. The data is always checked by
+        validate_fromdict().
+    '''
 
-        # Remove any __ in the file
-        jd = remove_underscore(jd)
+    jd = contents
+    if isinstance(contents, str):
+
+        # Load the json and remove any __ in the file
+        jd = remove_underscore(load_json(contents))
 
     # FIXME: Dilemma: Where to place this. It belongs here with JSON, but it
     #        would make sense to place it after running the built-in validator.
     #        Often the od validator is better at giving useful errors
     #        than the json validator. However the type checking of the json
     #        validator is better.
-    global SCHEMA  # pylint: disable=global-statement
-    if not SCHEMA and sys.version_info[0] >= 3:
-        with open(os.path.join(objdictgen.JSON_SCHEMA), 'r') as f:
-            SCHEMA = json.loads(remove_jasonc(f.read()))
-
-    if SCHEMA:
-        jsonschema.validate(jd, schema=SCHEMA)
+    validator = get_schema_validator(objdictgen.JSON_SCHEMA) if validate else None
+    if validator:
+        validator(jd)
 
     return node_fromdict(jd)
 
 
+def get_schema_validator(filename):
+    ''' Return a function validating a document against the JSON schema in
+        filename. The validator is compiled once, and again only if the file
+        is changed, using fastjsonschema if it is installed and jsonschema
+        otherwise. Returns None in py2, which does not validate against the
+        schema.
+    '''
+    if sys.version_info[0] < 3:
+        return None
+
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+    validator = SCHEMA_VALIDATORS.get(key)
+    if validator:
+        return validator
+
+    with open(filename, 'r') as f:
+        schema = json.loads(remove_jasonc(f.read()))
+    try:
+        import fastjsonschema  # pylint: disable=import-outside-toplevel
+        validator = fastjsonschema.compile(schema)
+    except ImportError:
+        pass
+    except Exception as exc:  # pylint: disable=broad-except
+        log.debug("Unable to compile schema '%s' with fastjsonschema: %s" % (filename, exc))
+
+    if not validator:
+        import jsonschema  # pylint: disable=import-outside-toplevel
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        validator = cls(schema).validate
+
+    SCHEMA_VALIDATORS[key] = validator
+    return validator
+
+
+def _orjson_backend():
+    import orjson  # pylint: disable=import-outside-toplevel
+
+    def dumps(obj):
+        data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        # Non-ASCII is written as UTF-8, while json escapes it
+        if not data.isascii():
+            raise ValueError("Non-ASCII output")
+        return data.decode('ascii')
+
+    return orjson.loads, dumps
+
+
+def _ujson_backend():
+    import ujson  # pylint: disable=import-outside-toplevel
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+
+    return ujson.loads, dumps
+
+
+def _json_backend():
+    if sys.version_info[0] < 3:
+        # Load the json with awareness on ordering in py2
+        def loads(text):
+            return json.loads(text, object_pairs_hook=ordereddict_hook)
+    else:
+        loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    return loads, dumps
+
+
+JSON_BACKEND_LOADERS = {
+    'orjson': _orjson_backend,
+    'ujson': _ujson_backend,
+    'json': _json_backend,
+}
+
+
+def get_json_backend(name=None):
+    ''' Return the (name, loads, dumps) functions for parsing JSON and
+        writing compact JSON. The backend is given by name or by
+        objdictgen.JSON_BACKEND. If neither is set, the first installed of
+        JSON_BACKENDS is used. The stdlib json module is the fallback.
+    '''
+    name = name or objdictgen.JSON_BACKEND
+    backend = JSON_BACKEND_CACHE.get(name)
+    if backend:
+        return backend
+
+    names = [name] if name else list(JSON_BACKENDS)
+    if sys.version_info[0] < 3:
+        names = []  # Needs the ordering of the json module
+    for n in names:
+        if n not in JSON_BACKEND_LOADERS:
+            raise ValueError("Unknown JSON backend '%s'" % n)
+        try:
+            backend = (n,) + JSON_BACKEND_LOADERS[n]()
+            break
+        except ImportError:
+            if name:
+                log.warning("JSON backend '%s' is not installed, using json" % n)
+    else:
+        backend = ('json',) + _json_backend()
+
+    JSON_BACKEND_CACHE[name] = backend
+    return backend
+
+
+def json_loads(text):
+    ''' Parse the JSON text. Text the backend cannot parse is given to the
+        json module, which also gives the error for invalid JSON. Note that
+        orjson reads integers outside the 64-bit range, which are not valid
+        in an OD, as floats.
+    '''
+    name, loads, _ = get_json_backend()
+    if name != 'json':
+        try:
+            return loads(text)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return get_json_backend('json')[1](text)
+
+
+def json_dumps_compact(obj):
+    ''' Return the compact JSON text of obj. The output of other backends
+        than json might differ in float format and escaping, but is parsed to
+        the same data.
+    '''
+    name, _, dumps = get_json_backend()
+    if name != 'json':
+        try:
+            return dumps(obj)
+        except (ValueError, TypeError, OverflowError):
+            pass
+    return get_json_backend('json')[2](obj)
+
+
+def load_json(text):
+    ''' Load a JSON string, which might contain jsonc comments '''
+
+    # Remove jsonc annotations
+    jsontext = remove_jasonc(text)
+
+    # The stripped parts are not fed piecewise to JSONDecoder.raw_decode(), as
+    # the comments split the document in the middle of objects and arrays, and
+    # raw_decode() only decodes complete values. Decoding the joined text
+    # once also lets json_loads() use the faster backends.
+    return json_loads(jsontext)
+
+
+def GenerateProfileJson(mapping, menuentries, name=''):
+    ''' Export a JSON string representation of a profile '''
+
+    jd = profile_todict(mapping, menuentries, name=name)
+    return json.dumps(jd, separators=(',', ': '), indent=2)
+
+
+def GenerateProfile(contents):
+    ''' Import a profile from JSON string or objects. Returns the profile
+        mapping and menu entries, as the "Mapping" and "AddMenuEntries"
+        variables in a .prf profile.
+    '''
+
+    jd = contents
+    if isinstance(contents, str):
+        jd = load_json(contents)
+
+    validator = get_schema_validator(objdictgen.JSON_PROFILE_SCHEMA)
+    if validator:
+        validator(jd)
+
+    return profile_fromdict(jd)
+
+
+def profile_todict(mapping, menuentries, name=''):
+    ''' Convert a profile mapping and menu entries into a dict '''
+
+    # The types defined by the profile itself can be used by name as well
+    objtypes_i2s, _ = get_object_types(dictionary=[
+        {'index': index, 'name': obj['name']}
+        for index, obj in mapping.items() if index < 0x1000
+    ])
+
+    entries = []
+    for index, obj in mapping.items():
+        obj = dict(obj)
+        obj["index"] = "0x{:04X}".format(index)
+        obj["struct"] = OD.to_string(obj["struct"], obj["struct"])
+        values = []
+        for sub in obj["values"]:
+            sub = dict(sub)
+            sub["type"] = objtypes_i2s.get(sub["type"], sub["type"])
+            values.append(copy_in_order(sub, JSON_PROFILE_SUB_ORDER))
+        obj["values"] = values
+        entries.append(copy_in_order(obj, JSON_PROFILE_ENTRY_ORDER))
+
+    jd = {
+        "$id": JSON_PROFILE_ID,
+        "$version": JSON_PROFILE_VERSION,
+        "$description": JSON_PROFILE_DESCRIPTION,
+        "$tool": str(objdictgen.ODG_PROGRAM) + ' ' + str(objdictgen.ODG_VERSION),
+        "$date": datetime.isoformat(datetime.now()),
+        "name": name,
+        "mapping": entries,
+        "menu": [
+            {"name": menuname, "index": ["0x{:04X}".format(index) for index in indexes]}
+            for menuname, indexes in menuentries
+        ],
+    }
+    return copy_in_order(jd, JSON_PROFILE_TOP_ORDER)
+
+
+def profile_fromdict(jd):
+    ''' Convert a dict jd into a profile mapping and menu entries '''
+
+    # Types are referenced by name, from the built-in types or the types
+    # defined in the profile
+    _, objtypes_s2i = get_object_types(dictionary=jd["mapping"])
+
+    mapping = ODict()
+    for obj in jd["mapping"]:
+        index = str_to_number(obj["index"])
+        if index in mapping:
+            raise ValidationError("Index 0x{0:04x} ({0}) is defined multiple times".format(index))
+        obj = ODict((k, v) for k, v in obj.items() if k != "index")
+        obj["struct"] = OD.from_string(obj["struct"], obj["struct"])
+        values = []
+        for sub in obj["values"]:
+            sub = ODict(sub)
+            if sub["type"] not in objtypes_s2i and not isinstance(sub["type"], int):
+                raise ValidationError("Index 0x{0:04x} ({0}): Unknown type '{1}'".format(index, sub["type"]))
+            sub["type"] = objtypes_s2i.get(sub["type"], sub["type"])
+            values.append(sub)
+        obj["values"] = values
+        mapping[index] = obj
+
+    menuentries = [
+        (menu["name"], [str_to_number(index) for index in menu["index"]])
+        for menu in jd.get("menu", [])
+    ]
+    return mapping, menuentries
+
+
 def node_todict(node, sort=False, rich=True, internal=False, validate=True):
     '''
         Convert a node to dict representation for serialization.
@@ -441,29 +807,18 @@ def node_todict(node, sort=False, rich=True, internal=False, validate=True):
             output is valid. Used to double check format.
     '''
 
-    # Get the dict representation of the node object
-    jd = node.GetDict()
-
-    # Rename the top-level fields
-    for k, v in {
-        'Name': 'name',
-        'Description': 'description',
-        'Type': 'type',
-        'ID': 'id',
-        'ProfileName': 'profile',
-        'DefaultStringSize': 'default_string_size',
-    }.items():
-        if k in jd:
-            jd[v] = jd.pop(k)
-
-    # Insert meta-data
-    jd.update({
-        '$id': JSON_ID,
-        '$version': JSON_INTERNAL_VERSION if internal else JSON_VERSION,
-        '$description': JSON_DESCRIPTION,
-        '$tool': str(objdictgen.ODG_PROGRAM) + ' ' + str(objdictgen.ODG_VERSION),
-        '$date': datetime.isoformat(datetime.now()),
-    })
+    # Build the top-level dict in output order. The node data is read as-is
+    # and is not copied.
+    jd = ODict([
+        ('$id', JSON_ID),
+        ('$version', JSON_INTERNAL_VERSION if internal else JSON_VERSION),
+        ('$description', JSON_DESCRIPTION),
+        ('$tool', str(objdictgen.ODG_PROGRAM) + ' ' + str(objdictgen.ODG_VERSION)),
+        ('$date', datetime.isoformat(datetime.now())),
+    ])
+    for k, v in NODE_TOP_FIELDS:
+        if v in node.__dict__:
+            jd[k] = node.__dict__[v]
 
     # Get the order for the indexes
     order = node.GetAllParameters(sort=sort)
@@ -476,8 +831,10 @@ def node_todict(node, sort=False, rich=True, internal=False, validate=True):
     for index in order:
         obj = None
         try:
-            # Get the internal dict representation of the node parameter
-            obj = node.GetIndexDict(index)
+            # Get the internal dict representation of the node parameter. It
+            # refers to the node data, which is copied by
+            # node_todict_parameter() where it is modified.
+            obj = node.GetIndexDict(index, share=True)
 
             # Add in the index (as dictionary is a list)
             obj["index"] = "0x{:04X}".format(index) if rich else index
@@ -506,7 +863,7 @@ def node_todict(node, sort=False, rich=True, internal=False, validate=True):
 
             info = []
             if not unused:
-                info = list(node.GetAllSubentryInfos(index))
+                info = node.GetSubentryInfosList(index)
 
             # Rename the mandatory field
             if "need" in obj:
@@ -563,14 +920,11 @@ def node_todict(node, sort=False, rich=True, internal=False, validate=True):
         copy_in_order(k, JSON_DICTIONARY_ORDER) for k in dictionary
     ]
 
-    # Rearrange the order of the top-level dict
-    jd = copy_in_order(jd, JSON_TOP_ORDER)
-
-    # Cleanup of unwanted members
+    # Any unknown node members are passed as-is
     # - NOTE: SpecificMenu is not used in dict representation
-    for k in ('Dictionary', 'ParamsDictionary', 'Profile', 'SpecificMenu',
-              'DS302', 'UserMapping', 'IndexOrder'):
-        jd.pop(k, None)
+    for k, v in node.__dict__.items():
+        if k not in NODE_MEMBERS:
+            jd[k] = v
 
     # Cross check verification to see if we later can import the generated dict
     if validate and not internal:
@@ -619,7 +973,7 @@ def node_todict_parameter(obj, node, index):
         if group != 'user':
             obj['group'] = group
 
-        baseobj = obj.pop(group)
+        baseobj = dict(obj.pop(group))  # Important, as its mutated here
         struct = baseobj["struct"]  # Checked in B
 
     else:
@@ -639,7 +993,7 @@ def node_todict_parameter(obj, node, index):
 
     # Ensure fields exists
     obj['struct'] = struct
-    obj['sub'] = obj.pop('values', [])
+    obj['sub'] = [dict(v) for v in obj.pop('values', [])]
 
     # Move subindex[1] to 'each' on objecs that contain 'nbmax'
     if len(obj['sub']) > 1 and 'nbmax' in obj['sub'][1]:
@@ -655,12 +1009,14 @@ def node_todict_parameter(obj, node, index):
     # Extract the params
     has_params = 'params' in obj
     has_dictionary = 'dictionary' in obj
-    params = obj.pop("params", {})
+    params = {  # Important, as its mutated here
+        k: dict(v) if isinstance(v, dict) else v
+        for k, v in obj.pop("params", {}).items()
+    }
     dictvals = obj.pop("dictionary", [])
 
     # These types places the params in the top-level dict
     if has_params and struct in (OD.VAR, OD.NVAR):
-        params = params.copy()  # Important, as its mutated here
         param0 = {}
         for k in FIELDS_PARAMS:
             if k in params:
@@ -917,11 +1273,14 @@ def node_fromdict(jd, internal=False):
             node.DS302[index] = obj['ds302']
         if 'user' in obj:
             node.UserMapping[index] = obj['user']
+        if 'profile' in obj or 'ds302' in obj or 'user' in obj:
+            node.ClearCache(index)
 
         # Verify against built-in data (don't verify repeated params)
         if 'built-in' in obj and not obj.get('repeat', False):
             baseobj = maps.MAPPING_DICTIONARY.get(index)
 
+            import deepdiff  # pylint: disable=import-outside-toplevel
             diff = deepdiff.DeepDiff(baseobj, obj['built-in'], view='tree')
             if diff:
                 if sys.version_info[0] >= 3:
@@ -1327,7 +1686,21 @@ def validate_fromdict(jsonobj, objtypes_i2s=None, objtypes_s2i=None):
             raise
 
 
+def diff_node_data(node):
+    """ Return a shallow copy of the node where the profile mappings are
+        ordinary dicts, so they are compared entry by entry.
+    """
+    from objdictgen.node import ProfileMapping  # pylint: disable=import-outside-toplevel
+
+    other = copy.copy(node)
+    for name, value in node.__dict__.items():
+        if isinstance(value, ProfileMapping):
+            setattr(other, name, copy.copy(value))
+    return other
+
+
 def diff_nodes(node1, node2, as_dict=True, validate=True):
+    import deepdiff  # pylint: disable=import-outside-toplevel
 
     diffs = {}
 
@@ -1365,7 +1738,7 @@ def diff_nodes(node1, node2, as_dict=True, validate=True):
                     entries.append((chtype, change, path.replace('root', '')))
 
     else:
-        diff = deepdiff.DeepDiff(node1, node2, exclude_paths=[
+        diff = deepdiff.DeepDiff(diff_node_data(node1), diff_node_data(node2), exclude_paths=[
             "root.IndexOrder"
         ], view='tree')
 
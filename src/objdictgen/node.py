@@ -28,8 +28,19 @@ from builtins import range
 import os
 import sys
 import re
+import ast
 import copy
+import numbers
+import operator
 import logging
+import weakref
+import marshal
+# Imported by another name, as the profiles defines the global Mapping when
+# they are evaluated, see ExecProfile()
+try:
+    from collections.abc import Mapping as MappingABC
+except ImportError:  # py2
+    from collections import Mapping as MappingABC
 from collections import OrderedDict
 import traceback
 from past.builtins import execfile
@@ -40,13 +51,20 @@ import objdictgen
 from objdictgen.nosis import pickle as nosis
 from objdictgen import maps
 from objdictgen.maps import OD, MAPPING_DICTIONARY
-from objdictgen import jsonod, eds_utils, gen_cfile
+from objdictgen import jsonod
+from objdictgen import odb
 
 if sys.version_info[0] >= 3:
+    from types import MappingProxyType as ReadOnlyDict
     unicode = str  # pylint: disable=invalid-name
     ODict = dict
+    intern = sys.intern  # pylint: disable=invalid-name
 else:
     ODict = OrderedDict
+    ReadOnlyDict = dict  # A copy rather than a view
+
+    def intern(value):  # pylint: disable=redefined-builtin
+        return value  # Unicode strings can't be interned
 
 log = logging.getLogger('objdictgen')
 
@@ -55,10 +73,68 @@ Style = colorama.Style
 
 RE_NAME = re.compile(r'(.*)\[(.*)\]')
 
+# Compiled StringFormat() templates, by template text
+STRING_FORMATS = {}
+
+# Operators allowed in StringFormat() template expressions
+STRING_FORMAT_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: lambda a, b: a / b,  # Same division semantics as eval() had
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+# Compiled values containing $NODEID, by (value, base). See CompileNodeIdValue()
+NODEID_VALUES = {}
+
+# The value forms with $NODEID which are compiled without eval()
+RE_NODEID_STRING = re.compile(r'''\s*(["'])([^"'\\]*)\1\s*$''')
+RE_NODEID_BASE = re.compile(
+    r'''\{True:(["'])([^"'\\]*)\1%\(base\+(\d+)\),False:(0x[0-9a-fA-F]+|[1-9]\d*|0)\}\[base<(\d+)\]$'''
+)
+RE_NODEID_EXPR = re.compile(r'\$NODEID(?:\s*([+-])\s*(0X[0-9A-F]+|[1-9]\d*|0))?$')
+
+# Profiles loaded by ImportProfile(), by profile path. The ProfileMapping of each
+# profile is shared by all nodes using the profile. It can't be modified, as it
+# returns a new copy of the entry on every access.
+PROFILES = {}
+
+# Read-only copies of profile data which is equal to a profile from
+# ImportProfile(), but has another order. They are shared by all nodes with
+# the same data, by the digest of the data. See Node.ShareProfiles()
+PROFILE_VARIANTS = {}
+
+# Profile file extensions, in order of preference. See ImportProfile()
+PROFILE_EXTENSIONS = (".prf.json", ".prf")
+
+# Version of the profile cache files. Increase when the format changes
+PROFILE_CACHE_VERSION = 2
+
+# Lookup table for the identical indexes in MAPPING_DICTIONARY. Created when
+# first needed, see Find.Index()
+MAPPING_INDEX_TABLE = None
+
+# Type lookup tables for MAPPING_DICTIONARY. Created when first needed, see
+# TypeRegistry.Builtin()
+MAPPING_TYPES = None
+
+# Lookup data derived from the mappings of each node. It is kept outside the
+# node objects, as Node.__dict__ is pickled, copied and compared as node data.
+NODE_CACHES = weakref.WeakKeyDictionary()
+
 
 # ------------------------------------------------------------------------------
 #                         Utils
 # ------------------------------------------------------------------------------
+def isOdb(filepath):
+    with open(filepath, 'rb') as f:
+        return odb.isOdb(f.read(len(odb.ODB_MAGIC)))
+
+
 def isXml(filepath):
     with open(filepath, 'r') as f:
         header = f.read(5)
@@ -71,21 +147,163 @@ def isEds(filepath):
         return header == "[FileInfo]"
 
 
-def StringFormat(text, idx, sub):  # pylint: disable=unused-argument
+def StringFormat(text, idx, sub):
     """
     Format the text given with the index and subindex defined
     """
+    return CompileStringFormat(text)(idx, sub)
+
+
+def CompileStringFormat(text):
+    """
+    Return a function fmt(idx, sub) which formats text with the index and
+    subindex. A text in the form "format[expr]" is formatted with the result of
+    the arithmetic expression expr, which may use the variables idx and sub.
+    The compiled functions are cached.
+    """
+    func = STRING_FORMATS.get(text)
+    if func is not None:
+        return func
+
     result = RE_NAME.match(text)
     if result:
-        fmt = result.groups()
+        fmt, expr = result.groups()
         try:
-            log.debug("EVAL StringFormat(): '%s'" % (fmt[1],))
-            return fmt[0] % eval(fmt[1])  # FIXME: Using eval is not safe
-        except Exception as exc:
-            log.debug("EVAL FAILED: %s" % (exc, ))
-            raise
+            evaluate = _compile_expression(ast.parse(expr.strip(), mode='eval').body)
+        except (SyntaxError, ValueError) as exc:
+            log.debug("COMPILE FAILED StringFormat(): '%s': %s" % (expr, exc))
+            raise_from(ValueError("Invalid expression '%s' in '%s'" % (expr, text)), exc)
+
+        def func(idx, sub):
+            return fmt % evaluate(idx, sub)
     else:
-        return text
+        def func(idx, sub):  # pylint: disable=unused-argument
+            return text
+
+    STRING_FORMATS[text] = func
+    return func
+
+
+def _compile_expression(node):
+    """
+    Return a function f(idx, sub) evaluating the ast node of a StringFormat()
+    expression. Only numbers, the variables idx and sub, tuples and arithmetic
+    operators are allowed.
+    """
+    # pylint: disable=no-member
+    if sys.version_info >= (3, 8):
+        if isinstance(node, ast.Constant) and isinstance(node.value, numbers.Number):
+            value = node.value
+            return lambda idx, sub: value
+    elif isinstance(node, ast.Num):
+        value = node.n
+        return lambda idx, sub: value
+
+    if isinstance(node, ast.Name):
+        if node.id == 'idx':
+            return lambda idx, sub: idx
+        if node.id == 'sub':
+            return lambda idx, sub: sub
+        raise ValueError("Unknown variable '%s'" % node.id)
+
+    if isinstance(node, ast.Tuple):
+        items = [_compile_expression(item) for item in node.elts]
+        return lambda idx, sub: tuple(item(idx, sub) for item in items)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in STRING_FORMAT_OPERATORS:
+        unop = STRING_FORMAT_OPERATORS[type(node.op)]
+        operand = _compile_expression(node.operand)
+        return lambda idx, sub: unop(operand(idx, sub))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in STRING_FORMAT_OPERATORS:
+        binop = STRING_FORMAT_OPERATORS[type(node.op)]
+        left = _compile_expression(node.left)
+        right = _compile_expression(node.right)
+        return lambda idx, sub: binop(left(idx, sub), right(idx, sub))
+
+    raise ValueError("Unsupported expression '%s'" % type(node).__name__)
+
+
+def CompileNodeIdValue(value, base):
+    """
+    Compile a value containing $NODEID, as stored in the Object Dictionary, for
+    the given base index number. Returns a tuple (raw, offset), where raw is the
+    value without compute and the computed value is node id + offset. If raw is
+    a number offset is None. Returns None if the value isn't in one of the
+    supported forms. The results are cached.
+    """
+    key = (value, base)
+    if key in NODEID_VALUES:
+        return NODEID_VALUES[key]
+
+    result = None
+    match = RE_NODEID_STRING.match(value)
+    if match:
+        raw = match.group(2)
+    else:
+        # In the form {True:"$NODEID+0x%X80"%(base+1),False:0x80000000}[base<4]
+        match = RE_NODEID_BASE.match(value)
+        raw = None
+        if match:
+            if base < int(match.group(5)):
+                try:
+                    raw = match.group(2) % (base + int(match.group(3)))
+                except (TypeError, ValueError):
+                    pass  # Let eval() report the error
+            else:
+                result = (int(match.group(4), 0), None)
+
+    if raw is not None:
+        match = RE_NODEID_EXPR.match(raw.upper())
+        if match:
+            offset = int(match.group(2), 0) if match.group(2) else 0
+            if match.group(1) == '-':
+                offset = -offset
+            result = (raw, offset)
+
+    NODEID_VALUES[key] = result
+    return result
+
+
+def CompactData(obj, memo=None):
+    """
+    Reduce the memory used by the data in obj by sharing equal strings and
+    integers. Dicts and lists are modified in place, so any sharing of them is
+    kept. Returns the compacted obj.
+    """
+    if memo is None:
+        memo = {}
+    if isinstance(obj, (str, unicode)):
+        return intern(obj)
+    if isinstance(obj, int) and not isinstance(obj, bool):
+        return memo.setdefault((type(obj), obj), obj)
+    if isinstance(obj, (dict, list)):
+        if id(obj) in memo:
+            return obj
+        memo[id(obj)] = obj
+        if isinstance(obj, dict):
+            items = [(CompactData(k, memo), CompactData(v, memo)) for k, v in obj.items()]
+            obj.clear()
+            obj.update(items)
+        else:
+            obj[:] = [CompactData(v, memo) for v in obj]
+    return obj
+
+
+def SameData(a, b):
+    """
+    Return True if a and b are equal, including the types of the values and the
+    order of the dicts.
+    """
+    if isinstance(a, dict):
+        return isinstance(b, dict) and list(a) == list(b) and all(
+            SameData(v, b[k]) for k, v in a.items()
+        )
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(
+            SameData(x, y) for x, y in zip(a, b)
+        )
+    return type(a) is type(b) and a == b
 
 
 def GetIndexRange(index):
@@ -128,22 +346,68 @@ def LE_to_BE(value, size):
 #                         Load mapping
 # ------------------------------------------------------------------------------
 def ImportProfile(profilename):
-    # Import profile
+    """
+    Import a profile and return its mapping and menu entries. The profile is
+    loaded once, and the returned read-only mapping is shared by all users of
+    the profile. The menu entries are a copy for each call.
+    """
 
     # Test if the profilename is a filepath which can be used directly. If not
     # treat it as the name
     # The UI use full filenames, while all other uses use profile names
+    # A JSON profile is preferred over the .prf profile when both exists
     profilepath = profilename
     if not os.path.exists(profilepath):
-        fname = "%s.prf" % profilename
+        fnames = ["%s%s" % (profilename, ext) for ext in PROFILE_EXTENSIONS]
         try:
             profilepath = next(
                 os.path.join(base, fname)
                 for base in objdictgen.PROFILE_DIRECTORIES
+                for fname in fnames
                 if os.path.exists(os.path.join(base, fname))
             )
         except StopIteration:
-            raise_from(ValueError("Unable to load profile '%s': '%s': No such file or directory" % (profilename, fname)), None)
+            raise_from(ValueError("Unable to load profile '%s': '%s': No such file or directory" % (profilename, fnames[-1])), None)
+    elif profilepath.endswith(".prf") and os.path.exists(profilepath + ".json"):
+        profilepath += ".json"
+
+    profilepath = os.path.abspath(profilepath)
+    stat = os.stat(profilepath)
+    key = (stat.st_mtime, stat.st_size)
+
+    cached = PROFILES.get(profilepath)
+    if not cached or cached[0] != key:
+        profile = ReadProfileCache(profilepath, key)
+        if not profile:
+            if profilepath.endswith(".json"):
+                mapping, menuentries = LoadJsonProfile(profilepath)
+            else:
+                mapping, menuentries = ExecProfile(profilepath)
+            profile = ProfileMapping.FromMapping(mapping), menuentries
+            WriteProfileCache(profilepath, key, profile)
+        PROFILES[profilepath] = (key,) + tuple(profile)
+
+    _, mapping, menuentries = PROFILES[profilepath]
+    # The menu entries are copied, as the users extend them
+    return mapping, copy.deepcopy(menuentries)
+
+
+def LoadJsonProfile(profilepath):
+    """ Load the JSON profile file and return its mapping and menu entries """
+
+    try:
+        log.debug("LOAD JSON PROFILE %s" % (profilepath,))
+        with open(profilepath, "r") as f:
+            return jsonod.GenerateProfile(f.read())
+    except Exception as exc:  # pylint: disable=broad-except
+        log.debug("LOAD JSON PROFILE FAILED: %s" % exc)
+        log.debug(traceback.format_exc())
+        raise_from(ValueError("Loading profile '%s' failed: %s" % (profilepath, exc)), exc)
+        return None  # To satisfy linter only
+
+
+def ExecProfile(profilepath):
+    """ Evaluate the profile file and return its mapping and menu entries """
 
     # Mapping and AddMenuEntries are expected to be defined by the execfile
     # The profiles requires some vars to be set
@@ -160,6 +424,123 @@ def ImportProfile(profilename):
         return None  # To satisfy linter only
 
 
+def GetProfileCacheFile(profilepath):
+    """ Return the cache file for the given profile, or None if disabled """
+
+    cachedir = objdictgen.PROFILE_CACHE_DIRECTORY
+    if not cachedir:
+        return None
+    import hashlib  # pylint: disable=import-outside-toplevel
+    # The marshal format depends on the python version
+    digest = hashlib.sha1(profilepath.encode('utf-8')).hexdigest()
+    return os.path.join(cachedir, "%s-py%d%d.prfc" % (digest, sys.version_info[0], sys.version_info[1]))
+
+
+def ReadProfileCache(profilepath, key):
+    """
+    Return the mapping and menu entries of the profile from the cache file,
+    or None if the cache is missing or is not up to date with the profile.
+    """
+
+    cachefile = GetProfileCacheFile(profilepath)
+    if not cachefile or not os.path.exists(cachefile):
+        return None
+    try:
+        with open(cachefile, 'rb') as f:
+            version, path, mtime, size, entries, table, menuentries = marshal.load(f)
+    except Exception as exc:  # pylint: disable=broad-except
+        log.debug("Unable to read profile cache '%s': %s" % (cachefile, exc))
+        return None
+    if (version, path, (mtime, size)) != (PROFILE_CACHE_VERSION, profilepath, key):
+        return None
+    log.debug("Using profile cache '%s' for %s" % (cachefile, profilepath))
+    return ProfileMapping(ODict(entries), table), menuentries
+
+
+def WriteProfileCache(profilepath, key, profile):
+    """
+    Write the mapping and menu entries of the profile to the cache file.
+    Failing to write the cache is not an error.
+    """
+
+    cachefile = GetProfileCacheFile(profilepath)
+    if not cachefile:
+        return
+    mapping, menuentries = profile
+    data = (
+        PROFILE_CACHE_VERSION, profilepath, key[0], key[1],
+        list(mapping.Entries.items()), mapping.Table, menuentries,
+    )
+    try:
+        if not os.path.exists(os.path.dirname(cachefile)):
+            os.makedirs(os.path.dirname(cachefile))
+        # Write to a temporary file first, so that concurrent users never see
+        # a partially written cache file
+        tmpfile = "%s.%d.tmp" % (cachefile, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            marshal.dump(data, f)
+        getattr(os, 'replace', os.rename)(tmpfile, cachefile)
+    except Exception as exc:  # pylint: disable=broad-except
+        log.debug("Unable to write profile cache '%s': %s" % (cachefile, exc))
+
+
+class ProfileMapping(MappingABC):
+    """
+    Read-only mapping of the entries of a profile. The entries are kept
+    serialized and each access unpacks a new copy of the entry, so that large
+    profiles don't cost more than the entries in use, and the mapping can be
+    shared by many nodes without any of them modifying it. Membership tests
+    and the table of identical indexes (see Find.IndexTable()) are available
+    without unpacking any entries. Copies of the mapping are ordinary dicts
+    which can be modified.
+    """
+
+    def __init__(self, entries, table):
+        self.Entries = entries  # Serialized entries, by index
+        self.Table = table
+
+    @classmethod
+    def FromMapping(cls, mapping):
+        """ Create the profile mapping from the mapping of a profile """
+        entries = ODict(
+            (index, marshal.dumps(entry))
+            for index, entry in mapping.items()
+        )
+        return cls(entries, Find.IndexTable(mapping))
+
+    def __getitem__(self, index):
+        return marshal.loads(self.Entries[index])
+
+    def get(self, index, default=None):
+        if index in self.Entries:
+            return self[index]
+        return default
+
+    def __contains__(self, index):
+        return index in self.Entries
+
+    def __iter__(self):
+        return iter(self.Entries)
+
+    def __len__(self):
+        return len(self.Entries)
+
+    def __eq__(self, other):
+        return other is self or MappingABC.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __copy__(self):
+        return ODict(self.items())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(ODict(self.items()), memo)
+
+    def __repr__(self):
+        return "<%s with %d entries>" % (self.__class__.__name__, len(self.Entries))
+
+
 # ------------------------------------------------------------------------------
 #                         Search in a Mapping Dictionary
 # ------------------------------------------------------------------------------
@@ -172,9 +553,11 @@ class Find:
         """
         Return the index of the typename given by searching in mappingdictionary
         """
+        if mappingdictionary is MAPPING_DICTIONARY:
+            return TypeRegistry.Builtin().Indexes.get(typename)
         return {
-            values["name"]: index
-            for index, values in mappingdictionary.items()
+            mappingdictionary[index]["name"]: index
+            for index in mappingdictionary
             if index < 0x1000
         }.get(typename)
 
@@ -183,6 +566,8 @@ class Find:
         """
         Return the name of the type by searching in mappingdictionary
         """
+        if mappingdictionary is MAPPING_DICTIONARY:
+            return TypeRegistry.Builtin().Names.get(typeindex)
         if typeindex < 0x1000 and typeindex in mappingdictionary:
             return mappingdictionary[typeindex]["name"]
         return None
@@ -192,6 +577,8 @@ class Find:
         """
         Return the default value of the type by searching in mappingdictionary
         """
+        if mappingdictionary is MAPPING_DICTIONARY:
+            return TypeRegistry.Builtin().Defaults.get(typeindex)
         if typeindex < 0x1000 and typeindex in mappingdictionary:
             return mappingdictionary[typeindex]["default"]
         return None
@@ -208,11 +595,11 @@ class Find:
         ]
 
     @staticmethod
-    def EntryName(index, mappingdictionary, compute=True):
+    def EntryName(index, mappingdictionary, compute=True, table=None):
         """
         Return the name of an entry by searching in mappingdictionary
         """
-        base_index = Find.Index(index, mappingdictionary)
+        base_index = Find.Index(index, mappingdictionary, table)
         if base_index:
             infos = mappingdictionary[base_index]
             if infos["struct"] & OD.IdenticalIndexes and compute:
@@ -221,37 +608,39 @@ class Find:
         return None
 
     @staticmethod
-    def EntryInfos(index, mappingdictionary, compute=True):
+    def EntryInfos(index, mappingdictionary, compute=True, table=None):
         """
         Return the informations of one entry by searching in mappingdictionary
         """
-        base_index = Find.Index(index, mappingdictionary)
+        base_index = Find.Index(index, mappingdictionary, table)
         if base_index:
-            obj = mappingdictionary[base_index].copy()
+            obj = {k: v for k, v in mappingdictionary[base_index].items() if k != "values"}
             if obj["struct"] & OD.IdenticalIndexes and compute:
                 obj["name"] = StringFormat(obj["name"], (index - base_index) // obj["incr"] + 1, 0)
-            obj.pop("values")
             return obj
         return None
 
     @staticmethod
-    def SubentryInfos(index, subindex, mappingdictionary, compute=True):
+    def SubentryInfos(index, subindex, mappingdictionary, compute=True, table=None):
         """
         Return the informations of one subentry of an entry by searching in mappingdictionary
         """
-        base_index = Find.Index(index, mappingdictionary)
+        base_index = Find.Index(index, mappingdictionary, table)
         if base_index:
-            struct = mappingdictionary[base_index]["struct"]
+            # The entry is looked up once, as a ProfileMapping unpacks it on
+            # each lookup
+            entry = mappingdictionary[base_index]
+            struct = entry["struct"]
             if struct & OD.Subindex:
                 infos = None
                 if struct & OD.IdenticalSubindexes:
                     if subindex == 0:
-                        infos = mappingdictionary[base_index]["values"][0].copy()
-                    elif 0 < subindex <= mappingdictionary[base_index]["values"][1]["nbmax"]:
-                        infos = mappingdictionary[base_index]["values"][1].copy()
+                        infos = entry["values"][0].copy()
+                    elif 0 < subindex <= entry["values"][1]["nbmax"]:
+                        infos = entry["values"][1].copy()
                 elif struct & OD.MultipleSubindexes:
                     idx = 0
-                    for subindex_infos in mappingdictionary[base_index]["values"]:
+                    for subindex_infos in entry["values"]:
                         if "nbmax" in subindex_infos:
                             if idx <= subindex < idx + subindex_infos["nbmax"]:
                                 infos = subindex_infos.copy()
@@ -263,11 +652,11 @@ class Find:
                                 break
                             idx += 1
                 elif subindex == 0:
-                    infos = mappingdictionary[base_index]["values"][0].copy()
+                    infos = entry["values"][0].copy()
 
                 if infos is not None and compute:
                     if struct & OD.IdenticalIndexes:
-                        incr = mappingdictionary[base_index]["incr"]
+                        incr = entry["incr"]
                     else:
                         incr = 1
                     infos["name"] = StringFormat(infos["name"], (index - base_index) // incr + 1, subindex)
@@ -282,11 +671,12 @@ class Find:
         """
         for index in mappingdictionary:
             if node.IsEntry(index):
-                for subindex, values in enumerate(mappingdictionary[index]["values"]):
-                    if mappingdictionary[index]["values"][subindex]["pdo"]:
-                        infos = node.GetEntryInfos(mappingdictionary[index]["values"][subindex]["type"])
-                        name = mappingdictionary[index]["values"][subindex]["name"]
-                        if mappingdictionary[index]["struct"] & OD.IdenticalSubindexes:
+                entry = mappingdictionary[index]
+                for subindex, values in enumerate(entry["values"]):
+                    if values["pdo"]:
+                        infos = node.GetEntryInfos(values["type"])
+                        name = values["name"]
+                        if entry["struct"] & OD.IdenticalSubindexes:
                             values = node.GetEntry(index)
                             for i in range(len(values) - 1):
                                 computed_name = name
@@ -311,23 +701,175 @@ class Find:
         ]
 
     @staticmethod
-    def Index(index, mappingdictionary):
+    def Index(index, mappingdictionary, table=None):
         """
         Return the index of the informations in the Object Dictionary in case of identical
-        indexes
+        indexes. table is the lookup table of mappingdictionary as returned by
+        Find.IndexTable(). It is created for each call if not given.
         """
+        global MAPPING_INDEX_TABLE  # pylint: disable=global-statement
+
         if index in mappingdictionary:
             return index
-        listpluri = [
-            idx for idx, mapping in mappingdictionary.items()
+        if table is None:
+            if mappingdictionary is MAPPING_DICTIONARY:
+                if MAPPING_INDEX_TABLE is None:
+                    MAPPING_INDEX_TABLE = Find.IndexTable(MAPPING_DICTIONARY)
+                table = MAPPING_INDEX_TABLE
+            else:
+                table = Find.IndexTable(mappingdictionary)
+        return table.get(index)
+
+    @staticmethod
+    def IndexTable(mappingdictionary):
+        """
+        Return a table of all indexes covered by the entries with identical
+        indexes in mappingdictionary, mapped to the index of their base entry.
+        Where entries overlap, the entry with the lowest index is used.
+        """
+        if isinstance(mappingdictionary, ProfileMapping):
+            return mappingdictionary.Table
+        table = {}
+        for idx, mapping in sorted(
+            (idx, mapping) for idx, mapping in mappingdictionary.items()
             if mapping["struct"] & OD.IdenticalIndexes
-        ]
-        for idx in sorted(listpluri):
-            nb_max = mappingdictionary[idx]["nbmax"]
-            incr = mappingdictionary[idx]["incr"]
-            if idx < index < idx + incr * nb_max and (index - idx) % incr == 0:
-                return idx
-        return None
+        ):
+            nb_max = mapping.get("nbmax", 0)
+            incr = mapping.get("incr", 0)
+            if incr <= 0:
+                continue
+            for index in range(idx + incr, idx + incr * nb_max, incr):
+                table.setdefault(index, idx)
+        return table
+
+
+# ------------------------------------------------------------------------------
+#                          Node lookup cache
+# ------------------------------------------------------------------------------
+
+class NodeCache(object):
+    """
+    Lookup data derived from the mappings of a node. The data is discarded
+    whenever the node mappings are modified or replaced.
+    """
+
+    def __init__(self):
+        self.Mappings = ()
+        self.IndexTables = {}
+        self.EntryNames = {}
+        self.EntryInfos = {}
+        self.SubentryInfos = {}
+        self.Types = None
+
+    def Invalidate(self, index=None):
+        """
+        Discard the data. If index is given, only the data that can depend on
+        the mapping of that index is discarded.
+        """
+        self.IndexTables = {}
+        self.EntryNames = {}
+        self.EntryInfos = {}
+        self.SubentryInfos = {}
+        if index is None or index < 0x1000:
+            self.Types = None
+
+    def Validate(self, mappings):
+        """
+        Invalidate the data if the given node mappings aren't the same objects
+        as the data were derived from
+        """
+        if len(mappings) != len(self.Mappings) or any(
+            a is not b for a, b in zip(mappings, self.Mappings)
+        ):
+            self.Invalidate()
+            self.Mappings = tuple(mappings)
+
+    def GetIndexTable(self, mapping):
+        """
+        Return the Find.IndexTable() of the given mapping
+        """
+        entry = self.IndexTables.get(id(mapping))
+        if entry is None or entry[0] is not mapping:
+            entry = self.IndexTables[id(mapping)] = (mapping, Find.IndexTable(mapping))
+        return entry[1]
+
+    def GetTypeRegistry(self):
+        """
+        Return the TypeRegistry of the node mappings
+        """
+        if self.Types is None:
+            self.Types = TypeRegistry(self.Mappings)
+        return self.Types
+
+
+class TypeRegistry(object):
+    """
+    Lookup tables for the types (index < 0x1000) defined in a list of mappings
+    and in MAPPING_DICTIONARY. Indexes, Names and Defaults give the same results
+    as searching the mappings in order and then MAPPING_DICTIONARY with
+    Find.TypeIndex(), Find.TypeName() and Find.TypeDefaultValue().
+    ObjectNames and ObjectIndexes maps the types the other way around, where
+    the later mappings take precedence over the earlier ones and
+    MAPPING_DICTIONARY.
+    """
+
+    def __init__(self, mappings=()):
+        layers = [self._layer(mapping) for mapping in mappings]
+        builtin = self._layer(MAPPING_DICTIONARY)
+
+        self.Indexes = self._resolve([layer[0] for layer in layers], builtin[0])
+        self.Names = self._resolve([layer[1] for layer in layers], builtin[1])
+        self.Defaults = self._resolve([layer[2] for layer in layers], builtin[2])
+
+        self.ObjectNames = {}
+        self.ObjectIndexes = {}
+        for _, names, _ in [builtin] + layers:
+            for index, name in names.items():
+                self.ObjectNames[index] = name
+                self.ObjectIndexes[name] = index
+
+    @staticmethod
+    def Builtin():
+        """
+        Return the TypeRegistry of MAPPING_DICTIONARY alone
+        """
+        global MAPPING_TYPES  # pylint: disable=global-statement
+        if MAPPING_TYPES is None:
+            MAPPING_TYPES = TypeRegistry()
+        return MAPPING_TYPES
+
+    @staticmethod
+    def _layer(mapping):
+        """
+        Return the name to index, index to name and index to default tables of
+        the types in mapping
+        """
+        indexes, names, defaults = {}, {}, {}
+        for index in mapping:
+            if index < 0x1000:
+                values = mapping[index]
+                indexes[values["name"]] = index
+                names[index] = values["name"]
+                defaults[index] = values.get("default")
+        return indexes, names, defaults
+
+    @staticmethod
+    def _resolve(layers, builtin):
+        """
+        Merge the tables of the layers into one. A falsy value in a layer gives
+        way to the next layer, and builtin is used when all layers are None.
+        """
+        table = {}
+        for key in set(builtin).union(*layers):
+            result = None
+            for layer in layers:
+                if result:
+                    break
+                result = layer.get(key)
+            if result is None:
+                result = builtin.get(key)
+            table[key] = result
+        return table
 
 
 # ------------------------------------------------------------------------------
@@ -361,26 +903,40 @@ class Node(object):
     # --------------------------------------------------------------------------
 
     @staticmethod
-    def LoadFile(filepath):
-        # type: (str) -> Node
-        """ Open a file and create a new node """
+    def LoadFile(filepath, validate=True):
+        # type: (str, bool) -> Node
+        """
+        Open a file and create a new node. Set validate to False to skip the
+        JSON schema validation of JSON files.
+        """
+        if isOdb(filepath):
+            log.debug("Loading binary OD '%s'" % filepath)
+            with open(filepath, "rb") as f:
+                node = odb.GenerateNode(f.read())
+            # The snapshot is already compacted
+            node.ShareProfiles()
+            return node
+
         if isXml(filepath):
             log.debug("Loading XML OD '%s'" % filepath)
             with open(filepath, "r") as f:
-                return nosis.xmlload(f)  # type: ignore
-
-        if isEds(filepath):
+                node = nosis.xmlload(f)  # type: Node
+        elif isEds(filepath):
             log.debug("Loading EDS '%s'" % filepath)
-            return eds_utils.GenerateNode(filepath)
-
-        log.debug("Loading JSON OD '%s'" % filepath)
-        with open(filepath, "r") as f:
-            return Node.LoadJson(f.read())
+            from objdictgen import eds_utils  # pylint: disable=import-outside-toplevel
+            node = eds_utils.GenerateNode(filepath)
+        else:
+            log.debug("Loading JSON OD '%s'" % filepath)
+            with open(filepath, "r") as f:
+                node = Node.LoadJson(f.read(), validate=validate)
+        node.Compact()
+        node.ShareProfiles()
+        return node
 
     @staticmethod
-    def LoadJson(contents):
+    def LoadJson(contents, validate=True):
         """ Import a new Node from a JSON string """
-        return jsonod.GenerateNode(contents)
+        return jsonod.GenerateNode(contents, validate=validate)
 
     def DumpFile(self, filepath, filetype="json", **kwargs):
         """ Save node into file """
@@ -393,18 +949,26 @@ class Node(object):
 
         if filetype == 'eds':
             log.debug("Writing EDS '%s'" % filepath)
+            from objdictgen import eds_utils  # pylint: disable=import-outside-toplevel
             eds_utils.GenerateEDSFile(filepath, self)
             return
 
         if filetype == 'json':
             log.debug("Writing JSON OD '%s'" % filepath)
-            jdata = self.DumpJson(**kwargs)
+            chunks = jsonod.GenerateJsonChunks(self, **kwargs)
             with open(filepath, "w") as f:
-                f.write(jdata)
+                f.writelines(chunks)
+            return
+
+        if filetype == 'odb':
+            log.debug("Writing binary OD '%s'" % filepath)
+            with open(filepath, "wb") as f:
+                f.write(odb.GenerateOdb(self))
             return
 
         if filetype == 'c':
             log.debug("Writing C files '%s'" % filepath)
+            from objdictgen import gen_cfile  # pylint: disable=import-outside-toplevel
             gen_cfile.GenerateFile(filepath, self)
             return
 
@@ -428,6 +992,32 @@ class Node(object):
             return [self.Profile, self.DS302, self.UserMapping]
         return [self.Profile, self.DS302]
 
+    def GetCache(self):
+        """
+        Return the lookup data derived from the mappings of this node
+        """
+        cache = NODE_CACHES.get(self)
+        if cache is None:
+            cache = NODE_CACHES[self] = NodeCache()
+        cache.Validate(self.GetMappings())
+        return cache
+
+    def ClearCache(self, index=None):
+        """
+        Discard the lookup data derived from the mappings of this node. Must be
+        called when the content of the mappings are modified. index is the
+        modified mapping entry, if only one.
+        """
+        cache = NODE_CACHES.get(self)
+        if cache is not None:
+            cache.Invalidate(index)
+
+    def GetIndexTable(self, mapping):
+        """
+        Return the identical indexes lookup table for one of the node mappings
+        """
+        return self.GetCache().GetIndexTable(mapping)
+
     def AddEntry(self, index, subindex=None, value=None):
         """
         Add a new entry in the Object Dictionary
@@ -616,11 +1206,13 @@ class Node(object):
                     self.UserMapping[index]["nbmax"] = nbmax
                 if default is not None:
                     self.UserMapping[index]["default"] = default
+                self.ClearCache(index)
                 return True
         elif subindex is not None and subindex == len(self.UserMapping[index]["values"]):
             if values is None:
                 values = {}
             self.UserMapping[index]["values"].append(values)
+            self.ClearCache(index)
             return True
         return False
 
@@ -647,6 +1239,7 @@ class Node(object):
                 self.UserMapping[index]["default"] = default
             if values is not None:
                 self.UserMapping[index]["values"] = values
+            self.ClearCache(index)
             return True
         if 0 <= subindex < len(self.UserMapping[index]["values"]) and values is not None:
             if "type" in values:
@@ -687,6 +1280,7 @@ class Node(object):
                     elif self.IsRealType(values["type"]):
                         self.SetEntry(index, subindex, 0.)
             self.UserMapping[index]["values"][subindex].update(values)
+            self.ClearCache(index)
             return True
         return False
 
@@ -699,9 +1293,11 @@ class Node(object):
         if index in self.UserMapping:
             if subindex is None:
                 self.UserMapping.pop(index)
+                self.ClearCache(index)
                 return True
             if subindex == len(self.UserMapping[index]["values"]) - 1:
                 self.UserMapping[index]["values"].pop(subindex)
+                self.ClearCache(index)
                 return True
         return False
 
@@ -738,16 +1334,81 @@ class Node(object):
 
     def Copy(self):
         """
-        Return a copy of the node
+        Return a copy of the node. The profile mappings Profile and DS302 are
+        never modified in place, so they are shared with the copy. The other
+        containers are copied down to the level where they can be modified.
         """
-        return copy.deepcopy(self)
+        node = copy.copy(self)
+
+        node.Dictionary = copy.copy(self.Dictionary)
+        for index, value in node.Dictionary.items():
+            if isinstance(value, list):
+                node.Dictionary[index] = list(value)
+
+        node.ParamsDictionary = copy.copy(self.ParamsDictionary)
+        for index, params in node.ParamsDictionary.items():
+            node.ParamsDictionary[index] = params = copy.copy(params)
+            for key, value in params.items():
+                if isinstance(value, dict):
+                    params[key] = copy.copy(value)
+
+        node.UserMapping = copy.deepcopy(self.UserMapping)
+        node.SpecificMenu = copy.deepcopy(self.SpecificMenu)
+        if 'IndexOrder' in self.__dict__:
+            node.IndexOrder = list(self.IndexOrder)
+        return node
+
+    def Compact(self):
+        """
+        Reduce the memory used by the node data, see CompactData(). The data
+        itself is unchanged.
+        """
+        memo = {}
+        for name in ("Dictionary", "ParamsDictionary", "Profile", "DS302", "UserMapping"):
+            CompactData(getattr(self, name), memo)
+
+    def ShareProfiles(self):
+        """
+        Replace the Profile and DS302 mappings with the shared profile mappings
+        from ImportProfile() if they are equal. The node data is saved in
+        order, so if the order of the entries or their members differ, a shared
+        read-only copy of the mapping in its own order is used instead.
+        """
+        for name, profilename in (("Profile", self.ProfileName), ("DS302", "DS-302")):
+            mapping = getattr(self, name)
+            if not mapping or profilename == "None":
+                continue
+            try:
+                profile, _ = ImportProfile(profilename)
+            except ValueError:
+                continue
+            if mapping is profile:
+                continue
+            if isinstance(mapping, ProfileMapping):
+                if mapping.Entries == profile.Entries:
+                    setattr(self, name, profile)
+                continue
+            if mapping != profile:
+                continue
+            if list(mapping) == list(profile) and all(
+                SameData(entry, profile[index]) for index, entry in mapping.items()
+            ):
+                setattr(self, name, profile)
+                continue
+            import hashlib  # pylint: disable=import-outside-toplevel
+            key = hashlib.sha1(repr(list(mapping.items())).encode('utf-8')).digest()
+            if key not in PROFILE_VARIANTS:
+                PROFILE_VARIANTS[key] = ProfileMapping.FromMapping(mapping)
+            setattr(self, name, PROFILE_VARIANTS[key])
 
     def GetDict(self):
         """ Return the class data as a dict """
         return copy.deepcopy(self.__dict__)
 
-    def GetIndexDict(self, index):
-        ''' Return a dict representation of the index '''
+    def GetIndexDict(self, index, share=False):
+        ''' Return a dict representation of the index. If share is set, the
+            members refer to the node data and must not be modified.
+        '''
         obj = {}
         if index in self.Dictionary:
             obj['dictionary'] = self.Dictionary[index]
@@ -763,6 +1424,8 @@ class Node(object):
             obj['built-in'] = maps.MAPPING_DICTIONARY[index]
         obj['base'] = self.GetBaseIndex(index)
         obj['groups'] = tuple(g for g in ('profile', 'ds302', 'user', 'built-in') if g in obj)
+        if share:
+            return obj
         return copy.deepcopy(obj)
 
     def GetIndexes(self):
@@ -771,15 +1434,28 @@ class Node(object):
         """
         return list(sorted(self.Dictionary))
 
-    def CompileValue(self, value, index, compute=True):
+    def CompileValue(self, value, index, compute=True, nodeid=None):
+        """
+        Return the value of the entry, with any $NODEID expression evaluated
+        against nodeid, or the node ID if None. If compute is False, the
+        expression is returned.
+        """
         if isinstance(value, (str, unicode)) and '$NODEID' in value.upper():
+            if nodeid is None:
+                nodeid = self.ID
             # NOTE: Don't change base, as the eval() use this
-            base = self.GetBaseIndexNumber(index)  # noqa: F841  pylint: disable=unused-variable
+            base = self.GetBaseIndexNumber(index)
+            compiled = CompileNodeIdValue(value, base)
+            if compiled is not None:
+                raw, offset = compiled
+                if compute and offset is not None:
+                    return nodeid + offset
+                return raw
             try:
                 log.debug("EVAL CompileValue() #1: '%s'" % (value,))
                 raw = eval(value)  # FIXME: Using eval is not safe
                 if compute and isinstance(raw, (str, unicode)):
-                    raw = raw.upper().replace("$NODEID", "self.ID")
+                    raw = raw.upper().replace("$NODEID", "nodeid")
                     log.debug("EVAL CompileValue() #2: '%s'" % (raw,))
                     return eval(raw)  # FIXME: Using eval is not safe
                 # NOTE: This has a side effect: It will strip away # '"$NODEID"' into '$NODEID'
@@ -794,6 +1470,26 @@ class Node(object):
         else:
             return value
 
+    def CompileValues(self, nodeid=None, compute=True):
+        """
+        Return the values of all entries in the Object Dictionary with the
+        $NODEID expressions evaluated against nodeid, or the node ID if None.
+        The values of entries with subindexes are given as lists like in
+        Node.Dictionary.
+        """
+        if nodeid is None:
+            nodeid = self.ID
+        values = {}
+        for index, value in self.Dictionary.items():
+            if isinstance(value, list):
+                values[index] = [
+                    self.CompileValue(v, index, compute, nodeid)
+                    for v in value
+                ]
+            else:
+                values[index] = self.CompileValue(value, index, compute, nodeid)
+        return values
+
     # --------------------------------------------------------------------------
     #                         Node Informations Functions
     # --------------------------------------------------------------------------
@@ -801,7 +1497,7 @@ class Node(object):
     def GetBaseIndex(self, index):
         """ Return the index number of the base object """
         for mapping in self.GetMappings():
-            result = Find.Index(index, mapping)
+            result = Find.Index(index, mapping, self.GetIndexTable(mapping))
             if result:
                 return result
         return Find.Index(index, MAPPING_DICTIONARY)
@@ -809,7 +1505,7 @@ class Node(object):
     def GetBaseIndexNumber(self, index):
         """ Return the index number from the base object """
         for mapping in self.GetMappings():
-            result = Find.Index(index, mapping)
+            result = Find.Index(index, mapping, self.GetIndexTable(mapping))
             if result is not None:
                 return (index - result) // mapping[result].get("incr", 1)
         result = Find.Index(index, MAPPING_DICTIONARY)
@@ -823,47 +1519,74 @@ class Node(object):
         return values, customisabletypes[values[1]][1]  # type: ignore
 
     def GetEntryName(self, index, compute=True):
+        cache = self.GetCache()
+        key = (index, compute)
+        if key in cache.EntryNames:
+            return cache.EntryNames[key]
         result = None
         mappings = self.GetMappings()
         i = 0
         while not result and i < len(mappings):
-            result = Find.EntryName(index, mappings[i], compute)
+            result = Find.EntryName(index, mappings[i], compute, cache.GetIndexTable(mappings[i]))
             i += 1
         if result is None:
             result = Find.EntryName(index, MAPPING_DICTIONARY, compute)
+        cache.EntryNames[key] = result
         return result
 
     def GetEntryInfos(self, index, compute=True):
-        result = None
-        mappings = self.GetMappings()
-        i = 0
-        while not result and i < len(mappings):
-            result = Find.EntryInfos(index, mappings[i], compute)
-            i += 1
-        r301 = Find.EntryInfos(index, MAPPING_DICTIONARY, compute)
-        if r301:
-            if result is not None:
-                r301.update(result)
-            return r301
-        return result
+        """
+        Return the informations of an entry. The returned dict is read-only
+        """
+        cache = self.GetCache()
+        key = (index, compute)
+        if key in cache.EntryInfos:
+            result = cache.EntryInfos[key]
+        else:
+            result = None
+            mappings = self.GetMappings()
+            i = 0
+            while not result and i < len(mappings):
+                result = Find.EntryInfos(index, mappings[i], compute, cache.GetIndexTable(mappings[i]))
+                i += 1
+            r301 = Find.EntryInfos(index, MAPPING_DICTIONARY, compute)
+            if r301:
+                if result is not None:
+                    r301.update(result)
+                result = r301
+            cache.EntryInfos[key] = result
+        if result is None:
+            return None
+        return ReadOnlyDict(result)
 
     def GetSubentryInfos(self, index, subindex, compute=True):
-        result = None
-        mappings = self.GetMappings()
-        i = 0
-        while not result and i < len(mappings):
-            result = Find.SubentryInfos(index, subindex, mappings[i], compute)
-            if result:
-                result["user_defined"] = i == len(mappings) - 1 and index >= 0x1000
-            i += 1
-        r301 = Find.SubentryInfos(index, subindex, MAPPING_DICTIONARY, compute)
-        if r301:
-            if result is not None:
-                r301.update(result)
-            else:
-                r301["user_defined"] = False
-            return r301
-        return result
+        """
+        Return the informations of a subentry. The returned dict is read-only
+        """
+        cache = self.GetCache()
+        key = (index, subindex, compute)
+        if key in cache.SubentryInfos:
+            result = cache.SubentryInfos[key]
+        else:
+            result = None
+            mappings = self.GetMappings()
+            i = 0
+            while not result and i < len(mappings):
+                result = Find.SubentryInfos(index, subindex, mappings[i], compute, cache.GetIndexTable(mappings[i]))
+                if result:
+                    result["user_defined"] = i == len(mappings) - 1 and index >= 0x1000
+                i += 1
+            r301 = Find.SubentryInfos(index, subindex, MAPPING_DICTIONARY, compute)
+            if r301:
+                if result is not None:
+                    r301.update(result)
+                else:
+                    r301["user_defined"] = False
+                result = r301
+            cache.SubentryInfos[key] = result
+        if result is None:
+            return None
+        return ReadOnlyDict(result)
 
     def GetEntryFlags(self, index):
         flags = []
@@ -888,6 +1611,16 @@ class Node(object):
                 flags.append("Missing")
         return flags
 
+    def GetSubentryInfosList(self, index, compute=True):
+        """
+        Return the read-only informations of all the subentries of an entry,
+        as given by GetSubentryInfos(). Unlike GetAllSubentryInfos(), the
+        informations are not copied and merged with the values and params.
+        """
+        values = self.Dictionary[index]
+        count = len(values) + 1 if isinstance(values, list) else 1
+        return [self.GetSubentryInfos(index, i, compute) for i in range(count)]
+
     def GetAllSubentryInfos(self, index, compute=True):
         values = self.GetEntry(index, compute=compute, aslist=True)
         entries = self.GetParamsEntry(index, aslist=True)
@@ -902,38 +1635,20 @@ class Node(object):
             info.update(entry)
             yield info
 
+    def GetTypeRegistry(self):
+        """
+        Return the TypeRegistry with the types of this node
+        """
+        return self.GetCache().GetTypeRegistry()
+
     def GetTypeIndex(self, typename):
-        result = None
-        mappings = self.GetMappings()
-        i = 0
-        while not result and i < len(mappings):
-            result = Find.TypeIndex(typename, mappings[i])
-            i += 1
-        if result is None:
-            result = Find.TypeIndex(typename, MAPPING_DICTIONARY)
-        return result
+        return self.GetTypeRegistry().Indexes.get(typename)
 
     def GetTypeName(self, typeindex):
-        result = None
-        mappings = self.GetMappings()
-        i = 0
-        while not result and i < len(mappings):
-            result = Find.TypeName(typeindex, mappings[i])
-            i += 1
-        if result is None:
-            result = Find.TypeName(typeindex, MAPPING_DICTIONARY)
-        return result
+        return self.GetTypeRegistry().Names.get(typeindex)
 
     def GetTypeDefaultValue(self, typeindex):
-        result = None
-        mappings = self.GetMappings()
-        i = 0
-        while not result and i < len(mappings):
-            result = Find.TypeDefaultValue(typeindex, mappings[i])
-            i += 1
-        if result is None:
-            result = Find.TypeDefaultValue(typeindex, MAPPING_DICTIONARY)
-        return result
+        return self.GetTypeRegistry().Defaults.get(typeindex)
 
     def GetMapVariableList(self, compute=True):
         list_ = list(Find.MapVariableList(MAPPING_DICTIONARY, self, compute))
@@ -1041,13 +1756,11 @@ class Node(object):
     def GetAllParameters(self, sort=False):
         """ Get a list of all the parameters """
 
-        order = list(self.UserMapping.keys())
-        order += [k for k in self.Dictionary.keys() if k not in order]
-        order += [k for k in self.ParamsDictionary.keys() if k not in order]
-        if self.Profile:
-            order += [k for k in self.Profile.keys() if k not in order]
-        if self.DS302:
-            order += [k for k in self.DS302.keys() if k not in order]
+        order = []
+        seen = set()
+        for mapping in (self.UserMapping, self.Dictionary, self.ParamsDictionary, self.Profile, self.DS302):
+            order += [k for k in mapping if k not in seen]
+            seen.update(mapping)
 
         if sort:
             order = sorted(order)
@@ -1056,9 +1769,10 @@ class Node(object):
         # Node might not contain IndexOrder if read from legacy od file
         elif hasattr(self, 'IndexOrder'):
             # Pick k from IndexOrder which is present in order
-            keys = [k for k in self.IndexOrder if k in order]
+            keys = [k for k in self.IndexOrder if k in seen]
             # Append any missing k from order that is not in IndexOrder
-            keys += (k for k in order if k not in keys)
+            picked = set(keys)
+            keys += (k for k in order if k not in picked)
             order = keys
 
         return order
@@ -1075,12 +1789,18 @@ class Node(object):
         self.UserMapping.pop(index, None)
         self.Dictionary.pop(index, None)
         self.ParamsDictionary.pop(index, None)
-        if self.DS302:
-            self.DS302.pop(index, None)
+        # The profile mappings are replaced rather than modified, as they are
+        # shared with the copies of the node, see Copy()
+        if index in self.DS302:
+            self.DS302 = copy.copy(self.DS302)
+            self.DS302.pop(index)
         if self.Profile:
-            self.Profile.pop(index, None)
+            if index in self.Profile:
+                self.Profile = copy.copy(self.Profile)
+                self.Profile.pop(index)
             if not self.Profile:
                 self.ProfileName = "None"
+        self.ClearCache(index)
 
     # --------------------------------------------------------------------------
     #                            Validator
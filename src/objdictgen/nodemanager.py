@@ -25,12 +25,14 @@ from builtins import object
 from builtins import range
 
 import os
+import sys
 import re
+import copy
 import codecs
 import logging
 import colorama
 
-from objdictgen.node import Node, Find, ImportProfile, BE_to_LE, LE_to_BE
+from objdictgen.node import Node, Find, ImportProfile, SameData, BE_to_LE, LE_to_BE
 from objdictgen import maps
 from objdictgen.maps import OD, MAPPING_DICTIONARY
 
@@ -39,7 +41,8 @@ log = logging.getLogger('objdictgen')
 Fore = colorama.Fore
 Style = colorama.Style
 
-UNDO_BUFFER_LENGTH = 20
+# Memory budget for the undo history of each node, in bytes (approximate)
+UNDO_BUFFER_SIZE = 16 * 1024 * 1024
 
 type_model = re.compile(r'([\_A-Z]*)([0-9]*)')
 range_model = re.compile(r'([\_A-Z]*)([0-9]*)\[([\-0-9]*)-([\-0-9]*)\]')
@@ -55,61 +58,215 @@ def GetNewId():
     return CURRENTID
 
 
+# Node attributes holding the Object Dictionary data, which changes are
+# recorded per index in the undo buffer
+UNDO_STORES = ("Dictionary", "ParamsDictionary", "Profile", "DS302", "UserMapping")
+
+# Node attributes which might be the shared profile mappings, see
+# ImportProfile(), and must be replaced rather than modified
+UNDO_SHARED_STORES = ("Profile", "DS302")
+
+# Marker for a missing index or attribute in a delta
+MISSING = object()
+
+
+def GetObjectSize(obj):
+    """
+    Return the approximate memory size of obj, including its contents
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(GetObjectSize(k) + GetObjectSize(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(GetObjectSize(v) for v in obj)
+    return size
+
+
+def CopyValue(value):
+    """
+    Return a deep copy of value, keeping the MISSING marker
+    """
+    if value is MISSING:
+        return value
+    return copy.deepcopy(value)
+
+
+def ApplyNodeDelta(node, delta, undo=False):
+    """
+    Apply the changes of a delta from UndoBuffer.PopChanges() to node. If undo
+    is set, the changes are reverted.
+    """
+    orders = {}
+    copied = set()
+    for store, index, subindex, old, new in (reversed(delta) if undo else delta):
+        value = old if undo else new
+        if store is None:
+            if value is MISSING:
+                node.__dict__.pop(index, None)
+            else:
+                setattr(node, index, copy.deepcopy(value))
+            continue
+        if index is None:
+            orders[store] = value
+            continue
+        if store in UNDO_SHARED_STORES and store not in copied:
+            setattr(node, store, copy.copy(getattr(node, store)))
+            copied.add(store)
+        container = getattr(node, store)
+        if subindex is not None:
+            container[index][subindex - 1] = value
+        elif value is MISSING:
+            container.pop(index, None)
+        else:
+            container[index] = copy.deepcopy(value)
+
+    for store, order in orders.items():
+        container = getattr(node, store)
+        if store in UNDO_SHARED_STORES and store not in copied:
+            container = copy.copy(container)
+        ordered = type(container)((index, container[index]) for index in order if index in container)
+        # Indexes not in the order, if any, are kept last
+        ordered.update(container)
+        setattr(node, store, ordered)
+
+    node.ClearCache()
+
+
 class UndoBuffer(object):
     """
-    Class implementing a buffer of changes made on the current editing Object Dictionary
+    Class implementing a buffer of changes made on the current editing Object Dictionary.
+    The buffer holds the node being edited and the changes between each state,
+    which are applied to the node when moving in the buffer. The history is
+    limited by the memory size of the changes, UNDO_BUFFER_SIZE.
+
+    The NodeManager methods modifying the node record the values of the
+    indexes and attributes they change with Record() and RecordAttribute()
+    before the change. Buffering() then makes the change a new state, so the
+    time and memory used follows the size of the change, not of the node.
     """
 
     def __init__(self, currentstate, issaved=False):
         """
         Constructor initialising buffer
         """
-        self.Buffer = []
-        self.CurrentIndex = -1
-        self.MinIndex = -1
-        self.MaxIndex = -1
-        # if current state is defined
-        if currentstate:
-            self.CurrentIndex = 0
-            self.MinIndex = 0
-            self.MaxIndex = 0
-        # Initialising buffer with currentstate at the first place
-        for i in range(UNDO_BUFFER_LENGTH):
-            self.Buffer.append(currentstate if not i else None)
+        self.State = currentstate
+        # Deltas[i] is the change from state MinIndex + i to the next state
+        self.Deltas = []
+        self.Sizes = []
+        # The values before the changes not yet buffered, by (store, index),
+        # and the order of the indexes of the stores where indexes are removed
+        self.Changes = {}
+        self.Orders = {}
+        self.CurrentIndex = 0
+        self.MinIndex = 0
+        self.MaxIndex = 0
         # Initialising index of state saved
         if issaved:
             self.LastSave = 0
         else:
             self.LastSave = -1
 
-    def Buffering(self, currentstate):
+    def Record(self, index, remove=False):
+        """
+        Record the values of index in the node before it is changed. Set
+        remove if the index might be removed, so its position can be restored.
         """
-        Add a new state in buffer
+        for store in UNDO_STORES:
+            container = getattr(self.State, store)
+            if (store, index) not in self.Changes:
+                self.Changes[store, index] = CopyValue(container.get(index, MISSING))
+            if remove and store not in self.Orders and index in container:
+                self.Orders[store] = list(container)
+
+    def RecordAttribute(self, name):
         """
-        self.CurrentIndex = (self.CurrentIndex + 1) % UNDO_BUFFER_LENGTH
-        self.Buffer[self.CurrentIndex] = currentstate
-        # Actualising buffer limits
+        Record the value of the node attribute name before it is changed
+        """
+        if (None, name) not in self.Changes:
+            self.Changes[None, name] = CopyValue(self.State.__dict__.get(name, MISSING))
+
+    def PopChanges(self):
+        """
+        Return the recorded changes as a list of (store, index, subindex, old,
+        new) tuples and clear the record. store is the name of the node
+        attribute holding the Object Dictionary data, or None for the other
+        attributes, which then are given by index. subindex is None if the
+        whole index has changed. A change with index None gives the order of
+        the indexes in store. Missing indexes and attributes have the value
+        MISSING.
+        """
+        delta = []
+        for (store, index), old in self.Changes.items():
+            if store is None:
+                new = self.State.__dict__.get(index, MISSING)
+            else:
+                new = getattr(self.State, store).get(index, MISSING)
+            if SameData(old, new):
+                continue
+            if store == "Dictionary" and isinstance(old, list) and isinstance(new, list) \
+                    and len(old) == len(new):
+                delta.extend(
+                    (store, index, subindex, o, n)
+                    for subindex, (o, n) in enumerate(zip(old, new), start=1)
+                    if not SameData(o, n)
+                )
+            else:
+                delta.append((store, index, None, old, CopyValue(new)))
+        for store, order in self.Orders.items():
+            neworder = list(getattr(self.State, store))
+            if order != neworder:
+                delta.append((store, None, None, order, neworder))
+        self.Changes = {}
+        self.Orders = {}
+        return delta
+
+    def RevertChanges(self):
+        """
+        Revert the recorded changes not yet buffered
+        """
+        if self.Changes:
+            ApplyNodeDelta(self.State, self.PopChanges(), undo=True)
+
+    def Buffering(self):
+        """
+        Add a new state in buffer, from the recorded changes
+        """
+        # Remove the states after the current state
+        del self.Deltas[self.CurrentIndex - self.MinIndex:]
+        del self.Sizes[self.CurrentIndex - self.MinIndex:]
+        if self.LastSave > self.CurrentIndex:
+            self.LastSave = -1
+
+        delta = self.PopChanges()
+        self.Deltas.append(delta)
+        self.Sizes.append(GetObjectSize(delta))
+        self.CurrentIndex += 1
         self.MaxIndex = self.CurrentIndex
-        if self.MinIndex == self.CurrentIndex:
+
+        # Remove the oldest states while the buffer is too large
+        while len(self.Deltas) > 1 and sum(self.Sizes) > UNDO_BUFFER_SIZE:
+            self.Deltas.pop(0)
+            self.Sizes.pop(0)
             # If the removed state was the state saved, there is no state saved in the buffer
             if self.LastSave == self.MinIndex:
                 self.LastSave = -1
-            self.MinIndex = (self.MinIndex + 1) % UNDO_BUFFER_LENGTH
-        self.MinIndex = max(self.MinIndex, 0)
+            self.MinIndex += 1
 
     def Current(self):
         """
         Return current state of buffer
         """
-        return self.Buffer[self.CurrentIndex]
+        return self.State
 
     def Previous(self):
         """
         Change current state to previous in buffer and return new current state
         """
         if self.CurrentIndex != self.MinIndex:
-            self.CurrentIndex = (self.CurrentIndex - 1) % UNDO_BUFFER_LENGTH
-            return self.Buffer[self.CurrentIndex]
+            self.RevertChanges()
+            self.CurrentIndex -= 1
+            ApplyNodeDelta(self.State, self.Deltas[self.CurrentIndex - self.MinIndex], undo=True)
+            return self.State
         return None
 
     def Next(self):
@@ -117,8 +274,10 @@ class UndoBuffer(object):
         Change current state to next in buffer and return new current state
         """
         if self.CurrentIndex != self.MaxIndex:
-            self.CurrentIndex = (self.CurrentIndex + 1) % UNDO_BUFFER_LENGTH
-            return self.Buffer[self.CurrentIndex]
+            self.RevertChanges()
+            ApplyNodeDelta(self.State, self.Deltas[self.CurrentIndex - self.MinIndex])
+            self.CurrentIndex += 1
+            return self.State
         return None
 
     def IsFirst(self):
@@ -242,7 +401,7 @@ class NodeManager(object):
                     addindexlist.append(idx)
                     addsubindexlist.append((idx, 8))
         # Add a new buffer
-        index = self.AddNodeBuffer(self.CurrentNode.Copy(), False)
+        index = self.AddNodeBuffer(self.CurrentNode, False)
         self.SetCurrentFilePath(None)
         # Add Mandatory indexes
         self.ManageEntriesOfCurrent(addindexlist, [])
@@ -259,7 +418,7 @@ class NodeManager(object):
         self.CurrentNode = node
         self.CurrentNode.ID = 0
 
-        index = self.AddNodeBuffer(self.CurrentNode.Copy(), load)
+        index = self.AddNodeBuffer(self.CurrentNode, load)
         self.SetCurrentFilePath(filepath if load else None)
         return index
 
@@ -326,6 +485,8 @@ class NodeManager(object):
         if node is None:
             node = self.CurrentNode
         assert node  # For mypy
+        if not disable_buffer:
+            self.RecordCurrentIndexes([index])
         # Informations about entry
         length = node.GetEntry(index, 0)
         infos = node.GetEntryInfos(index)
@@ -443,6 +604,8 @@ class NodeManager(object):
         disable_buffer = node is not None
         if node is None:
             node = self.CurrentNode
+        if not disable_buffer:
+            self.RecordCurrentIndexes(addinglist)
         # Add all the entries in addinglist
         for index in addinglist:
             infos = self.GetEntryInfos(index)
@@ -499,6 +662,8 @@ class NodeManager(object):
                 default = subentry_infos["default"]
             else:
                 default = self.GetTypeDefaultValue(subentry_infos["type"])
+            if not disable_buffer:
+                self.RecordCurrentIndexes([index])
             node.SetEntry(index, subindex, default)
             if not disable_buffer:
                 self.BufferCurrentNode()
@@ -510,29 +675,37 @@ class NodeManager(object):
         """
         assert self.CurrentNode  # For mypy
         mappings = self.CurrentNode.GetMappings()
+        self.RecordCurrentIndexes([index], remove=True)
         if index < 0x1000 and subindex is None:
             type_ = self.CurrentNode.GetEntry(index, 1)
             for i in mappings[-1]:
                 for value in mappings[-1][i]["values"]:
                     if value["type"] == index:
+                        self.RecordCurrentIndexes([i])
                         value["type"] = type_
             self.CurrentNode.RemoveMappingEntry(index)
             self.CurrentNode.RemoveEntry(index)
         elif index == 0x1200 and subindex is None:
             self.CurrentNode.RemoveEntry(0x1200)
         elif 0x1201 <= index <= 0x127F and subindex is None:
+            self.RecordCurrentLine(index, 0x127F)
             self.CurrentNode.RemoveLine(index, 0x127F)
         elif 0x1280 <= index <= 0x12FF and subindex is None:
+            self.RecordCurrentLine(index, 0x12FF)
             self.CurrentNode.RemoveLine(index, 0x12FF)
         elif 0x1400 <= index <= 0x15FF or 0x1600 <= index <= 0x17FF and subindex is None:
             if 0x1600 <= index <= 0x17FF and subindex is None:
                 index -= 0x200
+            self.RecordCurrentLine(index, 0x15FF)
             self.CurrentNode.RemoveLine(index, 0x15FF)
+            self.RecordCurrentLine(index + 0x200, 0x17FF)
             self.CurrentNode.RemoveLine(index + 0x200, 0x17FF)
         elif 0x1800 <= index <= 0x19FF or 0x1A00 <= index <= 0x1BFF and subindex is None:
             if 0x1A00 <= index <= 0x1BFF:
                 index -= 0x200
+            self.RecordCurrentLine(index, 0x19FF)
             self.CurrentNode.RemoveLine(index, 0x19FF)
+            self.RecordCurrentLine(index + 0x200, 0x1BFF)
             self.CurrentNode.RemoveLine(index + 0x200, 0x1BFF)
         else:
             found = False
@@ -545,7 +718,9 @@ class NodeManager(object):
                         diff = index - i
                         for j in list_:
                             jinfos = self.GetEntryInfos(j)
+                            self.RecordCurrentLine(j + diff, j + jinfos["incr"] * jinfos["nbmax"], jinfos["incr"])
                             self.CurrentNode.RemoveLine(j + diff, j + jinfos["incr"] * jinfos["nbmax"], jinfos["incr"])
+            self.RecordCurrentMapVariables()
             self.CurrentNode.RemoveMapVariable(index, subindex)
             if not found:
                 infos = self.GetEntryInfos(index)
@@ -562,6 +737,8 @@ class NodeManager(object):
             assert node  # For mypy
             if node.IsEntry(index):
                 raise ValueError("Index 0x%04X already defined!" % index)
+            if not disable_buffer:
+                self.RecordCurrentIndexes([index])
             node.AddMappingEntry(index, name=name, struct=struct)
             if struct == OD.VAR:
                 values = {"name": name, "type": 0x05, "access": "rw", "pdo": True}
@@ -596,6 +773,7 @@ class NodeManager(object):
         name, valuetype = customisabletypes[type_]
         size = self.GetEntryInfos(type_)["size"]
         default = self.GetTypeDefaultValue(type_)
+        self.RecordCurrentIndexes([index])
         if valuetype == 0:
             self.CurrentNode.AddMappingEntry(index, name="%s[%d-%d]" % (name, min_, max_), struct=OD.RECORD, size=size, default=default)
             self.CurrentNode.AddMappingEntry(index, 0, values={"name": "Number of Entries", "type": 0x05, "access": "ro", "pdo": False})
@@ -622,6 +800,7 @@ class NodeManager(object):
         if self.CurrentNode and self.CurrentNode.IsEntry(index):
             entry_infos = self.GetEntryInfos(index)
             if "callback" not in entry_infos:
+                self.RecordCurrentIndexes([index])
                 self.CurrentNode.SetParamsEntry(index, None, callback=value)
                 self.BufferCurrentNode()
 
@@ -630,6 +809,8 @@ class NodeManager(object):
         if node is None:
             node = self.CurrentNode
         if node and node.IsEntry(index):
+            if not disable_buffer:
+                self.RecordCurrentIndexes([index])
             if name == "value":
                 if editor == "map":
                     value = node.GetMapValue(value)
@@ -688,6 +869,8 @@ class NodeManager(object):
                 if editor == "type":
                     value = self.GetTypeIndex(value)
                     size = self.GetEntryInfos(value)["size"]
+                    if not disable_buffer:
+                        self.RecordCurrentMapVariables()
                     node.UpdateMapVariable(index, subindex, size)
                 elif editor in ["access", "raccess"]:
                     dic = {
@@ -707,6 +890,7 @@ class NodeManager(object):
                 self.BufferCurrentNode()
 
     def SetCurrentEntryName(self, index, name):
+        self.RecordCurrentIndexes([index])
         self.CurrentNode.SetMappingEntry(index, name=name)
         self.BufferCurrentNode()
 
@@ -717,6 +901,7 @@ class NodeManager(object):
         name, new_valuetype = customisabletypes[type_]
         size = self.GetEntryInfos(type_)["size"]
         default = self.GetTypeDefaultValue(type_)
+        self.RecordCurrentIndexes([index])
         if new_valuetype == 0:
             self.CurrentNode.SetMappingEntry(index, name="%s[%d-%d]" % (name, min_, max_), struct=OD.RECORD, size=size, default=default)
             if valuetype == 1:
@@ -743,8 +928,46 @@ class NodeManager(object):
     #                      Current Buffering Management Functions
     # --------------------------------------------------------------------------
 
+    def RecordCurrentIndexes(self, indexes, remove=False):
+        """
+        Record the values of the indexes of the current node before they are
+        changed, see UndoBuffer.Record()
+        """
+        buffer = self.UndoBuffers[self.NodeIndex]
+        for index in indexes:
+            buffer.Record(index, remove)
+
+    def RecordCurrentLine(self, index, max_, incr=1):
+        """
+        Record the indexes of the current node changed by Node.RemoveLine()
+        """
+        indexes = [index]
+        while index < max_ and self.CurrentNode.IsEntry(index + incr):
+            index += incr
+            indexes.append(index)
+        self.RecordCurrentIndexes(indexes, remove=True)
+
+    def RecordCurrentMapVariables(self):
+        """
+        Record the PDO mapping entries of the current node, which are changed
+        by Node.RemoveMapVariable() and Node.UpdateMapVariable()
+        """
+        self.RecordCurrentIndexes([
+            index for index in self.CurrentNode.Dictionary
+            if 0x1600 <= index <= 0x17FF or 0x1A00 <= index <= 0x1BFF
+        ])
+
+    def RecordCurrentAttributes(self, *names):
+        """
+        Record the values of the attributes of the current node before they
+        are changed
+        """
+        buffer = self.UndoBuffers[self.NodeIndex]
+        for name in names:
+            buffer.RecordAttribute(name)
+
     def BufferCurrentNode(self):
-        self.UndoBuffers[self.NodeIndex].Buffering(self.CurrentNode.Copy())
+        self.UndoBuffers[self.NodeIndex].Buffering()
 
     def CurrentIsSaved(self):
         return self.UndoBuffers[self.NodeIndex].IsCurrentSaved()
@@ -762,10 +985,12 @@ class NodeManager(object):
         return list(self.UndoBuffers)
 
     def LoadCurrentPrevious(self):
-        self.CurrentNode = self.UndoBuffers[self.NodeIndex].Previous().Copy()
+        self.UndoBuffers[self.NodeIndex].Previous()
+        self.CurrentNode = self.UndoBuffers[self.NodeIndex].Current()
 
     def LoadCurrentNext(self):
-        self.CurrentNode = self.UndoBuffers[self.NodeIndex].Next().Copy()
+        self.UndoBuffers[self.NodeIndex].Next()
+        self.CurrentNode = self.UndoBuffers[self.NodeIndex].Current()
 
     def AddNodeBuffer(self, currentstate=None, issaved=False):
         self.NodeIndex = GetNewId()
@@ -777,7 +1002,7 @@ class NodeManager(object):
     def ChangeCurrentNode(self, index):
         if index in self.UndoBuffers:
             self.NodeIndex = index
-            self.CurrentNode = self.UndoBuffers[self.NodeIndex].Current().Copy()
+            self.CurrentNode = self.UndoBuffers[self.NodeIndex].Current()
 
     def RemoveNodeBuffer(self, index):
         self.UndoBuffers.pop(index)
@@ -877,6 +1102,7 @@ class NodeManager(object):
         if not node:
             raise ValueError("No node loaded")
 
+        self.RecordCurrentIndexes(remove, remove=True)
         for index in remove:
             node.RemoveIndex(index)
 
@@ -903,6 +1129,7 @@ class NodeManager(object):
         return name, id_, type_, description
 
     def SetCurrentNodeInfos(self, name, id_, type_, description):
+        self.RecordCurrentAttributes("Name", "ID", "Type", "Description")
         self.CurrentNode.Name = name
         self.CurrentNode.ID = id_
         self.CurrentNode.Type = type_
@@ -916,6 +1143,7 @@ class NodeManager(object):
 
     def SetCurrentNodeDefaultStringSize(self, size):
         if self.CurrentNode:
+            self.RecordCurrentAttributes("DefaultStringSize")
             self.CurrentNode.DefaultStringSize = size
         else:
             Node.DefaultStringSize = size
@@ -1080,6 +1308,7 @@ class NodeManager(object):
                 nbparams = 0
             new_value = LE_to_BE(nbparams + 1, 4) + dcf_value[4:]
             new_value += LE_to_BE(index, 2) + LE_to_BE(subindex, 1) + LE_to_BE(size, 4) + LE_to_BE(value, size)
+            self.RecordCurrentIndexes([0x1F22])
             self.CurrentNode.SetEntry(0x1F22, node_id, new_value)
 
     # --------------------------------------------------------------------------
@@ -5,12 +5,15 @@ from builtins import object
 import sys
 from io import StringIO
 from collections import OrderedDict
-from xml.dom import minidom
+try:
+    from collections.abc import Mapping
+except ImportError:  # py2
+    from collections import Mapping
 from past.builtins import long
 from future.utils import raise_from
 
 from .xtoy import (
-    aton, ntoa,
+    aton, atons, ntoa,
     unsafe_string, unsafe_content,
     safe_string, safe_content,
 )
@@ -48,23 +51,66 @@ def getInBody(typename):
     return TYPE_IN_BODY.get(typename) or 0
 
 
-# Maintain list of object identities for multiple and cyclical references
-# (also to keep temporary objects alive)
-VISITED = {}
+class PickleContext(object):
+    """The state of one pickle or unpickle run. It is passed along instead
+    of being kept in module globals, so several runs can be made at once.
+    """
+    def __init__(self, deepcopy=0):
+        self.deepcopy = deepcopy
+        # Pickler: the containers that are referred more than once, by id().
+        # The objects are kept alive so their ids don't get reused
+        self.shared = {}
+        # Pickler: the id= written for each of the shared containers
+        self.ids = {}
+        # Unpickler: the objects by id= for multiple and cyclical references
+        self.visited = {}
+
+    def count_refs(self, obj, omit=None):
+        """Find the containers in the attributes of obj that are referred
+        more than once. Only these need an id= in the XML. The attributes are
+        searched through all nested containers. Nested instances are not
+        searched, as _tag_completer() can't pickle them."""
+        seen = {}
+        todo = [val for key, val in obj.__dict__.items() if not omit or key not in omit]
+        while todo:
+            thing = todo.pop()
+            if not isinstance(thing, (tuple, list, dict, Mapping)):
+                continue
+            if id(thing) in seen:
+                self.shared[id(thing)] = thing
+                continue
+            seen[id(thing)] = thing
+            if isinstance(thing, (dict, Mapping)):
+                for key, val in thing.items():
+                    todo.append(key)
+                    todo.append(val)
+            else:
+                todo.extend(thing)
+
+    def ref_id(self, thing):
+        """Return (objid, is_new) for the container thing, where objid is
+        None if it is not shared."""
+        objid = self.ids.get(id(thing))
+        if objid:
+            return objid, False
+        if id(thing) not in self.shared:
+            return None, True
+        objid = self.ids[id(thing)] = str(len(self.ids) + 1)
+        return objid, True
+
+    def save(self, objid, obj):
+        if objid:  # might be None, or empty - shouldn't use as key
+            self.visited[objid] = obj
 
 
 # entry point expected by XML_Pickle
 def thing_from_dom(filehandle):
-    global VISITED  # pylint: disable=global-statement
-    VISITED = {}
-    return _thing_from_dom(minidom.parse(filehandle), None)
+    from xml.dom import minidom  # pylint: disable=import-outside-toplevel
+    return _thing_from_dom(minidom.parse(filehandle), None, PickleContext())
 
 
-def _save_obj_with_id(node, obj):
-    objid = node.getAttribute('id')
-
-    if len(objid):  # might be None, or empty - shouldn't use as key
-        VISITED[objid] = obj
+def _save_obj_with_id(node, obj, ctx):
+    ctx.save(node.getAttribute('id'), obj)
 
 
 # Store the objects that can be pickled
@@ -190,29 +236,31 @@ def StreamReader(stream):
 
 
 def xmldump(iohandle=None, obj=None, binary=0, deepcopy=None, omit=None):
-    "Create the XML representation as a string."
+    """Create the XML representation as a string, or write it to iohandle
+    while the object is walked."""
     if deepcopy is None:
         deepcopy = 0
-    return _pickle_toplevel_obj(StreamWriter(iohandle, binary), obj, deepcopy, omit)
+    return _pickle_toplevel_obj(StreamWriter(iohandle, binary), obj, PickleContext(deepcopy), omit)
 
 
-def xmlload(filehandle):
-    "Load pickled object from file fh."
+def xmlload(filehandle, stream=True):
+    """Load pickled object from file fh. The file is unpickled while it is
+    parsed, unless stream is False, which unpickles from a DOM."""
+    if stream:
+        return thing_from_stream(StreamReader(filehandle))
     return thing_from_dom(StreamReader(filehandle))
 
 
 # -- support functions
 
 
-def _pickle_toplevel_obj(xml_list, py_obj, deepcopy, omit=None):
+def _pickle_toplevel_obj(xml_list, py_obj, ctx, omit=None):
     "handle the top object -- add XML header, etc."
 
-    # Store the ref id to the pickling object (if not deepcopying)
-    global VISITED  # pylint: disable=global-statement
-    VISITED = {}
-    if not deepcopy:
-        id_ = id(py_obj)
-        VISITED[id_] = py_obj
+    # Find the shared containers (if not deepcopying). The top object
+    # itself cannot be referred, so it gets no id
+    if not ctx.deepcopy:
+        ctx.count_refs(py_obj, omit)
 
     # note -- setting family="obj" lets us know that a mutator was used on
     # the object. Otherwise, it's tricky to unpickle both <PyObject ...>
@@ -239,14 +287,9 @@ def _pickle_toplevel_obj(xml_list, py_obj, deepcopy, omit=None):
     xml_list.append('<?xml version="1.0"?>\n'
                     + '<!DOCTYPE PyObject SYSTEM "PyObjects.dtd">\n')
 
-    if deepcopy:
-        xml_list.append('<PyObject %s>\n' % (extra))
-    elif id_ is not None:
-        xml_list.append('<PyObject %s id="%s">\n' % (extra, id_))
-    else:
-        xml_list.append('<PyObject %s>\n' % (extra))
+    xml_list.append('<PyObject %s>\n' % (extra))
 
-    pickle_instance(py_obj, xml_list, level=0, deepcopy=deepcopy, omit=omit)
+    pickle_instance(py_obj, xml_list, ctx, level=0, omit=omit)
     xml_list.append('</PyObject>\n')
 
     # returns None if xml_list is a fileobj, but caller should
@@ -254,7 +297,7 @@ def _pickle_toplevel_obj(xml_list, py_obj, deepcopy, omit=None):
     return xml_list.getvalue()
 
 
-def pickle_instance(obj, list_, level=0, deepcopy=0, omit=None):
+def pickle_instance(obj, list_, ctx, level=0, omit=None):
     """Pickle the given object into a <PyObject>
 
     Add XML tags to list. Level is indentation (for aesthetic reasons)
@@ -277,21 +320,21 @@ def pickle_instance(obj, list_, level=0, deepcopy=0, omit=None):
         for key, val in stuff.items():
             if omit and key in omit:
                 continue
-            list_.append(_attr_tag(key, val, level, deepcopy))
+            _attr_tag(list_, key, val, ctx, level)
     else:
         raise ValueError("'%s.__dict__' is not a dict" % (obj))
 
 
-def unpickle_instance(node):
+def unpickle_instance(node, ctx):
     """Take a <PyObject> or <.. type="PyObject"> DOM node and unpickle the object."""
 
     # we must first create an empty obj of the correct	type and place
-    # it in VISITED{} (so we can handle self-refs within the object)
+    # it in ctx.visited{} (so we can handle self-refs within the object)
     pyobj = obj_from_node(node)
-    _save_obj_with_id(node, pyobj)
+    _save_obj_with_id(node, pyobj, ctx)
 
     # slurp raw thing into a an empty object
-    raw = _thing_from_dom(node, _EmptyClass())
+    raw = _thing_from_dom(node, _EmptyClass(), ctx)
 
     # code below has same ordering as pickle.py
 
@@ -311,45 +354,54 @@ def unpickle_instance(node):
 
 
 # --- Functions to create XML output tags ---
-def _attr_tag(name, thing, level=0, deepcopy=0):
+# The tags are written to out as they are made, so the XML is never held in
+# memory as a whole (unless out is a memory stream)
+def _attr_tag(out, name, thing, ctx, level=0):
     start_tag = '  ' * level + ('<attr name="%s" ' % name)
     close_tag = '  ' * level + '</attr>\n'
-    return _tag_completer(start_tag, thing, close_tag, level, deepcopy)
+    _tag_completer(out, start_tag, thing, close_tag, level, ctx)
 
 
-def _item_tag(thing, level=0, deepcopy=0):
+def _item_tag(out, thing, ctx, level=0):
     start_tag = '  ' * level + '<item '
     close_tag = '  ' * level + '</item>\n'
-    return _tag_completer(start_tag, thing, close_tag, level, deepcopy)
+    _tag_completer(out, start_tag, thing, close_tag, level, ctx)
 
 
-def _entry_tag(key, val, level=0, deepcopy=0):
-    start_tag = '  ' * level + '<entry>\n'
-    close_tag = '  ' * level + '</entry>\n'
+def _entry_tag(out, key, val, ctx, level=0):
+    out.append('  ' * level + '<entry>\n')
     start_key = '  ' * level + '  <key '
     close_key = '  ' * level + '  </key>\n'
-    key_block = _tag_completer(start_key, key, close_key, level + 1, deepcopy)
+    _tag_completer(out, start_key, key, close_key, level + 1, ctx)
     start_val = '  ' * level + '  <val '
     close_val = '  ' * level + '  </val>\n'
-    val_block = _tag_completer(start_val, val, close_val, level + 1, deepcopy)
-    return start_tag + key_block + val_block + close_tag
+    _tag_completer(out, start_val, val, close_val, level + 1, ctx)
+    out.append('  ' * level + '</entry>\n')
 
 
-def _tag_compound(start_tag, family_type, thing, deepcopy, extra=''):
+def _tag_compound(start_tag, family_type, thing, ctx, extra=''):
     """Make a start tag for a compound object, handling deepcopy & refs.
     Returns (start_tag,do_copy), with do_copy indicating whether a
     copy of the data is needed.
     """
-    if deepcopy:
+    if ctx.deepcopy:
         # don't need ids in a deepcopied file (looks neater)
         start_tag = start_tag + '%s %s>\n' % (family_type, extra)
         return (start_tag, 1)
 
-    if VISITED.get(id(thing)):
-        start_tag = start_tag + '%s refid="%s" />\n' % (family_type, id(thing))
+    # the container is registered before its subitems are pickled, in
+    # case it contains self-references
+    objid, is_new = ctx.ref_id(thing)
+    if not is_new:
+        start_tag = start_tag + '%s refid="%s" />\n' % (family_type, objid)
         return (start_tag, 0)
 
-    start_tag = start_tag + '%s id="%s" %s>\n' % (family_type, id(thing), extra)
+    if objid is None:
+        # only shared containers need an id
+        start_tag = start_tag + '%s %s>\n' % (family_type, extra)
+        return (start_tag, 1)
+
+    start_tag = start_tag + '%s id="%s" %s>\n' % (family_type, objid, extra)
     return (start_tag, 1)
 
 
@@ -429,9 +481,9 @@ def _fix_family(family, typename):
     raise ValueError("family= must be given for unknown type '%s'" % typename)
 
 
-def _tag_completer(start_tag, orig_thing, close_tag, level, deepcopy):
-    tag_body = []
-
+def _tag_completer(out, start_tag, orig_thing, close_tag, level, ctx):
+    """Write the tag for orig_thing to out. Containers are written item by
+    item, so their tags are never built as a whole."""
     (mtag, thing, in_body, mextra) = (None, orig_thing, getInBody(type(orig_thing)), None)
 
     if thing is None:
@@ -513,69 +565,52 @@ def _tag_completer(start_tag, orig_thing, close_tag, level, deepcopy):
     #   1. When we make references, set type to referenced object
     #      type -- we don't need type when unpickling, but it may be useful
     #      to someone reading the XML file
-    #   2. For containers, we have to stick the container into visited{}
-    #      before pickling subitems, in case it contains self-references
-    #      (we CANNOT just move the visited{} update to the top of this
-    #      function, since that would screw up every _family_type() call)
+    #   2. For containers, _tag_compound() registers the container before
+    #      pickling subitems, in case it contains self-references
     elif isinstance(thing, tuple):
         start_tag, do_copy = _tag_compound(
             start_tag, _family_type('seq', 'tuple', mtag, mextra),
-            orig_thing, deepcopy)
+            orig_thing, ctx)
+        out.append(start_tag)
         if do_copy:
             for item in thing:
-                tag_body.append(_item_tag(item, level + 1, deepcopy))
-        else:
-            close_tag = ''
+                _item_tag(out, item, ctx, level + 1)
+            out.append(close_tag)
+        return
     elif isinstance(thing, list):
         start_tag, do_copy = _tag_compound(
             start_tag, _family_type('seq', 'list', mtag, mextra),
-            orig_thing, deepcopy)
-        # need to remember we've seen container before pickling subitems
-        VISITED[id(orig_thing)] = orig_thing
+            orig_thing, ctx)
+        out.append(start_tag)
         if do_copy:
             for item in thing:
-                tag_body.append(_item_tag(item, level + 1, deepcopy))
-        else:
-            close_tag = ''
-    elif isinstance(thing, dict):
+                _item_tag(out, item, ctx, level + 1)
+            out.append(close_tag)
+        return
+    elif isinstance(thing, (dict, Mapping)):
         start_tag, do_copy = _tag_compound(
             start_tag, _family_type('map', 'dict', mtag, mextra),
-            orig_thing, deepcopy)
-        # need to remember we've seen container before pickling subitems
-        VISITED[id(orig_thing)] = orig_thing
+            orig_thing, ctx)
+        out.append(start_tag)
         if do_copy:
             for key, val in thing.items():
-                tag_body.append(_entry_tag(key, val, level + 1, deepcopy))
-        else:
-            close_tag = ''
+                _entry_tag(out, key, val, ctx, level + 1)
+            out.append(close_tag)
+        return
     else:
         raise ValueError("Non-handled type %s" % type(thing))
 
-    # need to keep a ref to the object for two reasons -
-    #  1. we can ref it later instead of copying it into the XML stream
-    #  2. need to keep temporary objects around so their ids don't get reused
-
-    # if DEEPCOPY, we can skip this -- reusing ids is not an issue if we
-    # never look at them
-    if not deepcopy:
-        VISITED[id(orig_thing)] = orig_thing
+    out.append(start_tag + close_tag)
 
-    return start_tag + ''.join(tag_body) + close_tag
 
-
-def _thing_from_dom(dom_node, container=None):
+def _thing_from_dom(dom_node, container, ctx):
     "Converts an [xml_pickle] DOM tree to a 'native' Python object"
     for node in dom_node.childNodes:
         if not hasattr(node, '_attrs') or not node.nodeName != '#text':
             continue
 
         if node.nodeName == "PyObject":
-            container = unpickle_instance(node)
-            try:
-                id_ = node.getAttribute('id')
-                VISITED[id_] = container
-            except KeyError:
-                pass  # Accepable, not having id only affects caching
+            container = unpickle_instance(node, ctx)
 
         elif node.nodeName in ['attr', 'item', 'key', 'val']:
             node_family = node.getAttribute('family')
@@ -587,9 +622,9 @@ def _thing_from_dom(dom_node, container=None):
 
             if len(ref_id):	 # might be empty or None
                 if node.nodeName == 'attr':
-                    setattr(container, node_name, VISITED[ref_id])
+                    setattr(container, node_name, ctx.visited[ref_id])
                 else:
-                    container.append(VISITED[ref_id])
+                    container.append(ctx.visited[ref_id])
 
                 # done, skip rest of block
                 continue
@@ -606,17 +641,17 @@ def _thing_from_dom(dom_node, container=None):
             elif node_family == 'atom':
                 node_val = node_valuetext
             elif node_family == 'seq':
-                # seq must exist in VISITED{} before we unpickle subitems,
+                # seq must exist in ctx.visited{} before we unpickle subitems,
                 # in order to handle self-references
                 seq = []
-                _save_obj_with_id(node, seq)
-                node_val = _thing_from_dom(node, seq)
+                _save_obj_with_id(node, seq, ctx)
+                node_val = _thing_from_dom(node, seq, ctx)
             elif node_family == 'map':
-                # map must exist in VISITED{} before we unpickle subitems,
+                # map must exist in ctx.visited{} before we unpickle subitems,
                 # in order to handle self-references
                 mapping = ODict()
-                _save_obj_with_id(node, mapping)
-                node_val = _thing_from_dom(node, mapping)
+                _save_obj_with_id(node, mapping, ctx)
+                node_val = _thing_from_dom(node, mapping, ctx)
             elif node_family == 'uniq':
                 # uniq is another special type that is handled here instead
                 # of below.
@@ -666,10 +701,10 @@ def _thing_from_dom(dom_node, container=None):
             else:
                 container.append(node_val)
 
-            _save_obj_with_id(node, node_val)
+            _save_obj_with_id(node, node_val, ctx)
 
         elif node.nodeName == 'entry':
-            keyval = _thing_from_dom(node, [])
+            keyval = _thing_from_dom(node, [], ctx)
             key, val = keyval[0], keyval[1]
             container[key] = val
             # <entry> has no id for refchecking
@@ -678,3 +713,185 @@ def _thing_from_dom(dom_node, container=None):
             raise ValueError("Element %s is not in PyObjects.dtd" % node.nodeName)
 
     return container
+
+
+# Types the unpickler accepts, see _thing_from_dom()
+UNPICKLE_TYPES = {'None', 'numeric', 'string', 'list', 'tuple', 'dict', 'True', 'False'}
+
+
+class _StreamFrame(object):
+    """ An open element in thing_from_stream() """
+    __slots__ = ('elem', 'leaf', 'family', 'type', 'value', 'numeric')
+
+    def __init__(self, elem, leaf, family=None, type_=None, value=None):
+        self.elem = elem
+        self.leaf = leaf  # Set if the children of the element are ignored
+        self.family = family
+        self.type = type_
+        self.value = value
+        self.numeric = None  # Positions of unconverted numeric items in seq
+
+
+# entry point of the streaming unpickler
+def thing_from_stream(filehandle):
+    """Unpickle the XML from filehandle as it is parsed, without building a
+    DOM. Each element is released when it has been unpickled. The result is
+    the same as thing_from_dom()."""
+    from xml.etree import ElementTree  # pylint: disable=import-outside-toplevel
+
+    ctx = PickleContext()
+    container = None
+    stack = []  # Open elements
+    skip = 0  # Depth of ignored elements
+
+    for event, elem in ElementTree.iterparse(filehandle, events=('start', 'end')):
+
+        if event == 'start':
+            if skip or (stack and stack[-1].leaf):
+                skip += 1
+            else:
+                stack.append(_stream_start(elem, stack, ctx))
+            continue
+
+        if skip:
+            skip -= 1
+            continue
+
+        frame = stack.pop()
+        parent = stack[-1] if stack else None
+
+        if elem.tag == 'PyObject':
+            container = _stream_end_instance(frame, ctx)
+        elif elem.tag == 'entry':
+            keyval = frame.value
+            key, val = keyval[0], keyval[1]
+            parent.value[key] = val
+            # <entry> has no id for refchecking
+        else:
+            _stream_end_value(frame, parent, ctx)
+
+        # Release the element
+        elem.clear()
+        if parent is not None:
+            parent.elem.remove(elem)
+
+    return container
+
+
+def _stream_start(elem, stack, ctx):
+    """Return the frame for the start of the element elem. Containers are
+    created and added to ctx.visited{} here, so self-references can be handled.
+    """
+    tag = elem.tag
+
+    if tag == 'PyObject':
+        if stack:
+            raise ValueError("Element %s is not in PyObjects.dtd" % tag)
+        # we must first create an empty obj of the correct type and place
+        # it in ctx.visited{} (so we can handle self-refs within the object)
+        klass = get_class_from_name(elem.get('class', ''))
+        pyobj = klass.__new__(klass)
+        _save_elem_with_id(elem, pyobj, ctx)
+        # raw thing is slurped into an empty object
+        return _StreamFrame(elem, False, value=(pyobj, _EmptyClass()))
+
+    if tag == 'entry':
+        return _StreamFrame(elem, False, value=[])
+
+    if tag not in ('attr', 'item', 'key', 'val'):
+        raise ValueError("Element %s is not in PyObjects.dtd" % tag)
+
+    # check refid first (if present, type is type of referenced object)
+    ref_id = elem.get('refid')
+    if ref_id:
+        return _StreamFrame(elem, True, family='ref', value=ctx.visited[ref_id])
+
+    node_type = elem.get('type', '')
+    node_family = _fix_family(elem.get('family', ''), node_type)
+
+    if node_family == 'seq':
+        value = []
+        _save_elem_with_id(elem, value, ctx)
+        return _StreamFrame(elem, False, node_family, node_type, value)
+    if node_family == 'map':
+        value = ODict()
+        _save_elem_with_id(elem, value, ctx)
+        return _StreamFrame(elem, False, node_family, node_type, value)
+    if node_family == 'uniq':
+        if node_type not in ('True', 'False'):
+            raise ValueError("Unknown uniq type %s" % node_type)
+    elif node_family not in ('none', 'atom'):
+        raise ValueError("Unknown family %s,%s,%s" % (node_family, node_type, elem.get('name', '')))
+    return _StreamFrame(elem, True, node_family, node_type)
+
+
+def _stream_end_value(frame, parent, ctx):
+    """Make the value of the <attr>, <item>, <key> or <val> element of
+    frame and add it to the parent, as _thing_from_dom()."""
+    elem = frame.elem
+    node_family = frame.family
+    node_type = frame.type
+
+    # step 1 - set node_val to basic thing
+    if node_family == 'none':
+        node_val = None
+    elif node_family == 'atom':
+        # Get text from node, whether in value=, or in element body
+        if 'value' in elem.attrib:
+            node_val = unsafe_string(elem.get('value'))
+        elif elem.text is not None:
+            node_val = unsafe_content(elem.text)
+        else:
+            node_val = ''
+    elif node_family == 'uniq':
+        node_val = node_type == 'True'
+    else:
+        # 'ref', 'seq' and 'map'
+        node_val = frame.value
+        if frame.numeric:
+            # Convert the numeric items of the seq in one go
+            for i, val in zip(frame.numeric, atons([node_val[i] for i in frame.numeric])):
+                node_val[i] = val
+
+    # step 2 - take basic thing and make exact thing
+    if node_family != 'ref':
+        if node_type not in UNPICKLE_TYPES:
+            raise ValueError("Unknown type %s,%s" % (elem.tag, node_type))
+        if node_type == 'None':
+            node_val = None
+        elif node_type == 'numeric':
+            if elem.tag == 'item' and parent.family == 'seq' and 'id' not in elem.attrib:
+                # Items without id are converted when the seq ends
+                if parent.numeric is None:
+                    parent.numeric = []
+                parent.numeric.append(len(parent.value))
+                parent.value.append(node_val)
+                return
+            node_val = aton(node_val)
+        elif node_type == 'tuple':
+            node_val = tuple(node_val)
+
+    if elem.tag == 'attr':
+        container = parent.value[1] if parent.elem.tag == 'PyObject' else parent.value
+        setattr(container, elem.get('name', ''), node_val)
+    else:
+        parent.value.append(node_val)
+
+    if node_family != 'ref':
+        _save_elem_with_id(elem, node_val, ctx)
+
+
+def _stream_end_instance(frame, ctx):
+    """Return the object of the <PyObject> element of frame."""
+    pyobj, raw = frame.value
+
+    stuff = raw.__dict__
+    for k, v in stuff.items():
+        setattr(pyobj, k, v)
+
+    _save_elem_with_id(frame.elem, pyobj, ctx)
+    return pyobj
+
+
+def _save_elem_with_id(elem, obj, ctx):
+    ctx.save(elem.get('id'), obj)
@@ -1,7 +1,9 @@
 import sys
 import re
 import logging
+from builtins import chr
 from past.builtins import long
+from future.utils import raise_from
 
 log = logging.getLogger('objdictgen.nosis')
 
@@ -9,7 +11,7 @@ log = logging.getLogger('objdictgen.nosis')
 
 pat_fl = r'[-+]?(((((\d+)?[.]\d+|\d+[.])|\d+)[eE][+-]?\d+)|((\d+)?[.]\d+|\d+[.]))'
 re_float = re.compile(pat_fl + r'$')
-re_zero = r'[+-]?0$'
+re_zero = re.compile(r'[+-]?0$')
 pat_int = r'[-+]?[1-9]\d*'
 re_int = re.compile(pat_int + r'$')
 pat_flint = r'(%s|%s)' % (pat_fl, pat_int)    # float or int
@@ -21,52 +23,91 @@ re_complex = re.compile(pat_complex + r'$')
 pat_complex2 = r'(%s):(%s)' % (pat_flint, pat_flint)
 re_complex2 = re.compile(pat_complex2 + r'$')
 
+# Decimal integers as checked by the fast path of aton(), and a space
+# separated list of them for atons()
+DIGITS_1_9 = '123456789'
+re_decimals = re.compile(r'(?:[-+]?[1-9][0-9]*|0)(?: (?:[-+]?[1-9][0-9]*|0))*\Z')
+
+# Escapes in python string literals, which are made by repr() in
+# safe_string(). Escapes of one character are looked up in UNESCAPE_TABLE
+re_escape = re.compile(r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N\{[^}]*\}|[0-7]{1,3}|[\s\S]?)')
+# The exec based unescaping replaced "'" with "\047" first, so "\'" is read
+# as the text "\047".
+UNESCAPE_TABLE = {
+    '\\': '\\', "'": '\\047', '"': '"', '\n': '',
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+}
+
 
 def aton(s):
+    """Convert the string s from ntoa() to a number. Decimal integers are
+    converted directly, other numbers are matched by the regex for the
+    number format given by the characters in s."""
     # -- massage the string slightly
     s = s.strip()
     while s[0] == '(' and s[-1] == ')':  # remove optional parens
         s = s[1:-1]
 
-    # -- test for cases
-    if re.match(re_zero, s):
-        return 0
-
-    if re.match(re_float, s):
-        return float(s)
+    # -- fast path for decimal integers, which are most numbers
+    if s.lstrip('+-')[:1] in DIGITS_1_9 and '_' not in s:
+        try:
+            return int(s)
+        except ValueError:
+            pass
+
+    # -- test for cases, dispatched on the characters in the string
+    if 'j' in s or 'J' in s:
+        if re_complex.match(s):
+            return complex(s)
+
+    elif ':' in s:
+        if re_complex2.match(s):
+            r, i = s.split(':')
+            return complex(float(r), float(i))
+
+    elif 'x' in s or 'X' in s:
+        m = re_hex.match(s)
+        if m:
+            n = long(m.group(3), 16)
+            if n < sys.maxsize:
+                n = int(n)
+            if m.group(1) == '-':
+                n = n * (-1)
+            return n
+
+    elif s[-1:] in ('l', 'L'):
+        if re_long.match(s):
+            return long(s.rstrip('lL'))
+
+    elif '.' in s or 'e' in s or 'E' in s:
+        if re_float.match(s):
+            return float(s)
 
-    if re.match(re_long, s):
-        return long(s.rstrip('lL'))
-
-    if re.match(re_int, s):
-        return int(s)
+    else:
+        if re_zero.match(s):
+            return 0
 
-    m = re.match(re_hex, s)
-    if m:
-        n = long(m.group(3), 16)
-        if n < sys.maxsize:
-            n = int(n)
-        if m.group(1) == '-':
-            n = n * (-1)
-        return n
+        if re_int.match(s):
+            return int(s)
 
-    m = re.match(re_oct, s)
-    if m:
-        n = long(m.group(3), 8)
-        if n < sys.maxsize:
-            n = int(n)
-        if m.group(1) == '-':
-            n = n * (-1)
-        return n
+        m = re_oct.match(s)
+        if m:
+            n = long(m.group(3), 8)
+            if n < sys.maxsize:
+                n = int(n)
+            if m.group(1) == '-':
+                n = n * (-1)
+            return n
 
-    if re.match(re_complex, s):
-        return complex(s)
+    raise ValueError("Invalid string '%s' passed to to_number()'d" % s)
 
-    if re.match(re_complex2, s):
-        r, i = s.split(':')
-        return complex(float(r), float(i))
 
-    raise ValueError("Invalid string '%s' passed to to_number()'d" % s)
+def atons(strings):
+    """Convert the list of strings with aton(). Lists of only decimal
+    integers are converted in one go."""
+    if re_decimals.match(' '.join(strings)):
+        return [int(s) for s in strings]
+    return [aton(s) for s in strings]
 
 
 # we use ntoa() instead of repr() to ensure we have a known output format
@@ -105,16 +146,36 @@ def safe_string(s):
     return s[1:-1]  # without the extra single-quotes
 
 
+def _unescape(match):
+    code = match.group(1)
+    if not code:
+        raise ValueError("Trailing backslash in string")
+    c = code[0]
+    if len(code) == 1:
+        if c in UNESCAPE_TABLE:
+            return UNESCAPE_TABLE[c]
+        if c in 'xuUN':
+            raise ValueError("Truncated \\%s escape in string" % c)
+        if c not in '01234567':
+            return '\\' + c  # Unknown escapes are kept as-is
+    if c in 'xuU':
+        return chr(int(code[1:], 16))
+    if c == 'N':
+        import unicodedata  # pylint: disable=import-outside-toplevel
+        try:
+            return unicodedata.lookup(code[2:-1])
+        except KeyError as exc:
+            raise_from(ValueError("Unknown \\N escape '%s' in string" % code), exc)
+    return chr(int(code, 8))
+
+
 def unsafe_string(s):
-    # for Python escapes, exec the string
-    # (niggle w/ literalizing apostrophe)
-    _s = s = s.replace("'", r"\047")
-    # log.debug("EXEC in unsafe_string(): '%s'" % ("s='" + s + "'",))
-    exec("s='" + s + "'")
-    if s != _s:
-        log.debug("EXEC in unsafe_string(): '%s' -> '%s'" % (_s, s))
+    """Take the string returned by safe_string() and recreate the original
+    string, by evaluating the escapes of python string literals."""
+    if '\\' not in s:
+        return s
     # XML entities (DOM does it for us)
-    return s
+    return re_escape.sub(_unescape, s)
 
 
 def safe_content(s):
@@ -0,0 +1,117 @@
+""" OD binary snapshot serialization and deserialization functions """
+#
+#    Copyright (C) 2022-2023  Svein Seldal, Laerdal Medical AS
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301
+#    USA
+
+# The odb format is a snapshot of the internal data model of the node, made
+# for fast reloading of the same ODs. It is not an exchange format: The data
+# is stored with marshal, which depends on the python version. Only load odb
+# files from trusted sources.
+#
+# File layout:
+#   header   ODB_HEADER: magic, format version, marshal version, checksum
+#            (crc32) and length of the payload
+#   payload  marshal data of (order, members, mappings, profiles), where
+#            order is the list of node members, members are the plain node
+#            members, mappings are the dict members as lists of items and
+#            profiles are the ProfileMapping members as (entries, table)
+
+import struct
+import marshal
+import zlib
+import logging
+from future.utils import raise_from
+
+import objdictgen
+
+log = logging.getLogger('objdictgen')
+
+ODB_MAGIC = b'\x89ODB\r\n\x1a\n'
+ODB_VERSION = 1
+ODB_HEADER = struct.Struct('<8sHHII')
+
+# The marshal version, which shares the equal objects of the node
+ODB_MARSHAL_VERSION = min(marshal.version, 4)
+
+# Node members which are ordered dicts
+ODB_MAPPINGS = ('Dictionary', 'ParamsDictionary', 'Profile', 'DS302', 'UserMapping')
+
+
+def isOdb(header):
+    """ Return True if the header is the start of an odb file """
+    return header[:len(ODB_MAGIC)] == ODB_MAGIC
+
+
+def GenerateOdb(node):
+    """ Export a binary odb representation of the node """
+    from objdictgen.node import ProfileMapping  # pylint: disable=import-outside-toplevel
+
+    members, mappings, profiles = {}, {}, {}
+    for name, value in node.__dict__.items():
+        if isinstance(value, ProfileMapping):
+            profiles[name] = (list(value.Entries.items()), value.Table)
+        elif name in ODB_MAPPINGS:
+            mappings[name] = list(value.items())
+        else:
+            members[name] = value
+
+    payload = marshal.dumps(
+        (list(node.__dict__), members, mappings, profiles), ODB_MARSHAL_VERSION
+    )
+    header = ODB_HEADER.pack(
+        ODB_MAGIC, ODB_VERSION, ODB_MARSHAL_VERSION,
+        zlib.crc32(payload) & 0xffffffff, len(payload),
+    )
+    return header + payload
+
+
+def GenerateNode(data):
+    """ Import a node from the binary odb data """
+    from objdictgen.node import ProfileMapping, ODict  # pylint: disable=import-outside-toplevel
+
+    if len(data) < ODB_HEADER.size or not isOdb(data):
+        raise ValueError("Not an odb file")
+
+    _, version, marshal_version, checksum, length = ODB_HEADER.unpack_from(data)
+    if version != ODB_VERSION:
+        raise ValueError("Unsupported odb version %s, expected %s" % (version, ODB_VERSION))
+    if marshal_version > marshal.version:
+        raise ValueError("The odb file is made by a newer python version")
+
+    payload = data[ODB_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) & 0xffffffff != checksum:
+        raise ValueError("The odb file is corrupt, checksum error")
+
+    try:
+        order, members, mappings, profiles = marshal.loads(payload)
+    except (ValueError, EOFError, TypeError) as exc:
+        raise_from(ValueError("Unable to read the odb data: %s" % exc), exc)
+        return None  # To satisfy linter only
+
+    node = objdictgen.Node()
+    node.__dict__.clear()
+    for name in order:
+        if name in profiles:
+            entries, table = profiles[name]
+            value = ProfileMapping(ODict(entries), table)
+        elif name in mappings:
+            value = ODict(mappings[name])
+        else:
+            value = members[name]
+        setattr(node, name, value)
+
+    return node
@@ -0,0 +1,184 @@
+import os
+import copy
+import re
+import glob
+import json
+import pytest
+import objdictgen
+from objdictgen import jsonod
+from objdictgen.node import Node
+
+
+def _remove_jasonc_regex(text):
+    """ Reference implementation of jsonod.remove_jasonc() """
+    def __re_sub(match):
+        if match.group(2) is not None:
+            return ""
+        return match.group(1)
+
+    return re.sub(
+        r"(\".*?\"|\'.*?\')|(/\*.*?\*/|//[^\r\n]*$)",
+        __re_sub,
+        text,
+        flags=re.MULTILINE | re.DOTALL
+    )
+
+
+def _generate_json_regex(node, compact=False, sort=False, internal=False, validate=True):
+    """ Reference implementation of jsonod.GenerateJson() """
+    jd, objtypes_s2i = jsonod.node_todict(
+        node, sort=sort, internal=internal, validate=validate, rich=not compact,
+    )
+    if compact:
+        return json.dumps(jd, separators=(',', ':'))
+
+    text = json.dumps(jd, separators=(',', ': '), indent=2)
+    out = re.sub(r'^(\s*)"__(\w+)": "(.*)",?$', r'\1// "\2": "\3"', text, flags=re.MULTILINE)
+
+    def _index_repl(m):
+        p = m.group(1)
+        n = v = m.group(2)
+        if p == 'index':
+            n = jsonod.str_to_number(v)
+        if p == 'type':
+            n = objtypes_s2i.get(v, v)
+        if n != v:
+            return m.group(0) + '  // {}'.format(n)
+        return m.group(0)
+
+    return re.sub(r'"(index|type)": "([a-zA-Z0-9_]+)",?$', _index_repl, out, flags=re.MULTILINE)
+
+
+def test_remove_jasonc(basepath):
+
+    fnames = glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.json'), recursive=True)
+    fnames += glob.glob(os.path.join(basepath, 'src', 'objdictgen', 'schema', '*.json'))
+    assert fnames
+
+    for fname in fnames:
+        with open(fname, 'r') as f:
+            text = f.read()
+        assert jsonod.remove_jasonc(text) == _remove_jasonc_regex(text)
+
+
+def test_remove_jasonc_strings():
+
+    assert jsonod.remove_jasonc('{"a": 1}') == '{"a": 1}'
+    assert jsonod.remove_jasonc('{"a": 1} // comment\n') == '{"a": 1} \n'
+    assert jsonod.remove_jasonc('{"a": 1} // comment\r\n') == '{"a": 1} \r\n'
+    assert jsonod.remove_jasonc('{"a": 1} // comment') == '{"a": 1} '
+    assert jsonod.remove_jasonc('{/* x\n y */"a": 1}') == '{"a": 1}'
+    assert jsonod.remove_jasonc('{"a": "http://x /* y */"}') == '{"a": "http://x /* y */"}'
+    assert jsonod.remove_jasonc('{"a\\"// b": 1}') == '{"a\\"// b": 1}'
+    assert jsonod.remove_jasonc('{"a": 1 / 2}') == '{"a": 1 / 2}'
+    assert jsonod.remove_jasonc('{"a": 1} /* open') == '{"a": 1} /* open'
+
+    text = '{\n  // "__name": "x"\n  "a": "\\\\", /* b */ "c": [1, 2]\n}'
+    assert json.loads(jsonod.remove_jasonc(text)) == {"a": "\\", "c": [1, 2]}
+    assert jsonod.remove_jasonc('{"a": "x // y" // z\n}') == '{"a": "x // y" \n}'
+    assert jsonod.remove_jasonc('{"a": "x\n// y"}') == '{"a": "x\n'
+
+
+def _strip_date(text):
+    return re.sub(r'"\$date": ?"[^"]*"', '"$date": ""', text)
+
+
+def test_generatejson(wd, odfile):
+
+    m1 = Node.LoadFile(odfile + '.od')
+    m1.Validate(fix=True)
+
+    for kw in ({}, {'compact': True}, {'sort': True}, {'internal': True}):
+        a = jsonod.GenerateJson(m1, **kw)
+        b = _generate_json_regex(m1, **kw)
+        assert _strip_date(a) == _strip_date(b)
+
+    # The file is written in chunks
+    m1.DumpFile(odfile.name + '.json', filetype='json')
+    with open(odfile.name + '.json', 'r') as f:
+        assert _strip_date(f.read()) == _strip_date(jsonod.GenerateJson(m1))
+
+
+def test_jsonc_chunks():
+
+    data = {
+        "__a": "x\"y",
+        "b": [],
+        "c": {},
+        "d": [1, 2.5, None, True, "\u00e6"],
+        "e": {"__index": "0x1000", "type": "FOO", "index": "bar"},
+        "f": {"index": 1, 2: "x", None: 0, False: 1},
+    }
+    text = ''.join(jsonod.iter_jsonc_chunks(data, {"FOO": 7}))
+    ref = json.dumps(data, separators=(',', ': '), indent=2)
+    ref = re.sub(r'^(\s*)"__(\w+)": "(.*)",?$', r'\1// "\2": "\3"', ref, flags=re.MULTILINE)
+    ref = ref.replace('"0x1000"', '"0x1000"  // 4096').replace('"FOO",', '"FOO",  // 7')
+    assert text == ref
+
+
+def test_node_todict_readonly(odfile):
+
+    m1 = Node.LoadFile(odfile + '.od')
+    m1.Validate(fix=True)
+    before = copy.deepcopy(m1.__dict__)
+
+    for kw in ({}, {'rich': False}, {'sort': True}, {'internal': True}):
+        jd1, _ = jsonod.node_todict(m1, **kw)
+        jd2, _ = jsonod.node_todict(m1, **kw)
+        jd1.pop('$date')
+        jd2.pop('$date')
+        assert jd1 == jd2
+
+    # The node data is read, not modified
+    assert m1.__dict__ == before
+
+
+@pytest.fixture(params=['orjson', 'ujson'])
+def json_backend(request, monkeypatch):
+    """ Fixture selecting each of the fast JSON backends, when installed """
+    pytest.importorskip(request.param)
+    monkeypatch.setattr(objdictgen, 'JSON_BACKEND', request.param)
+    assert jsonod.get_json_backend()[0] == request.param
+    yield request.param
+
+
+def test_json_backend_parity(basepath, json_backend, profile, monkeypatch):
+
+    fnames = glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.json'), recursive=True)
+    fnames += glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.od'), recursive=True)
+    assert fnames
+
+    for fname in fnames:
+        m1 = Node.LoadFile(fname)
+        m1.Validate(fix=True)
+        compact = jsonod.GenerateJson(m1, compact=True)
+        m2 = Node.LoadJson(compact)
+        with open(fname, 'r') as f:
+            text = f.read()
+        jd = json.loads(jsonod.remove_jasonc(text)) if fname.endswith('.json') else None
+
+        # Compare with the json module
+        monkeypatch.setattr(objdictgen, 'JSON_BACKEND', 'json')
+        ref = jsonod.GenerateJson(m1, compact=True)
+        assert json.loads(_strip_date(compact)) == json.loads(_strip_date(ref))
+        assert m2.__dict__ == Node.LoadJson(ref).__dict__
+        if jd is not None:
+            assert jsonod.load_json(text) == jd
+        monkeypatch.setattr(objdictgen, 'JSON_BACKEND', json_backend)
+
+        if jd is not None:
+            assert jsonod.load_json(text) == jd
+            assert Node.LoadFile(fname).__dict__ == Node.LoadJson(jsonod.remove_jasonc(text)).__dict__
+
+
+def test_json_backend_fallback(json_backend):
+
+    # Values the backends handle differently are given to the json module
+    for text in ('[18446744073709551615, -1e400]', '[NaN, Infinity]', '{"a": 1, "a": 2}'):
+        assert repr(jsonod.json_loads(text)) == repr(json.loads(text))
+
+    for obj in ({1: [2 ** 70]}, {"\u00e6\u007f": float('nan')}, (1, None, True)):
+        assert jsonod.json_dumps_compact(obj) == json.dumps(obj, separators=(',', ':'))
+
+    with pytest.raises(json.JSONDecodeError):
+        jsonod.json_loads('{"a": }')
@@ -0,0 +1,463 @@
+import os
+import sys
+import types
+import copy
+import pytest
+import objdictgen
+from objdictgen import maps, jsonod
+from objdictgen.maps import OD
+from objdictgen.node import Find, StringFormat, RE_NAME, ProfileMapping
+from objdictgen.nosis import pickle as nosis
+
+
+def _index_scan(index, mappingdictionary):
+    """ Reference implementation of Find.Index() """
+    if index in mappingdictionary:
+        return index
+    for idx in sorted(
+        idx for idx, mapping in mappingdictionary.items()
+        if mapping["struct"] & OD.IdenticalIndexes
+    ):
+        nb_max = mappingdictionary[idx]["nbmax"]
+        incr = mappingdictionary[idx]["incr"]
+        if idx < index < idx + incr * nb_max and (index - idx) % incr == 0:
+            return idx
+    return None
+
+
+def test_find_index():
+
+    for index in range(0x10000):
+        assert Find.Index(index, maps.MAPPING_DICTIONARY) == _index_scan(index, maps.MAPPING_DICTIONARY)
+
+
+def test_find_index_profile(profile):
+
+    for name in ('DS-401', 'DS-408', 'Test'):
+        mapping, _ = objdictgen.ImportProfile(name)
+        table = Find.IndexTable(mapping)
+        entries = dict(mapping)
+        assert Find.IndexTable(entries) == table
+        for index in range(0x1000, 0x10000):
+            assert Find.Index(index, mapping, table) == _index_scan(index, entries)
+
+
+def test_node_index_table(basepath):
+
+    node = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master.od'))
+
+    assert node.GetBaseIndex(0x2002) is None
+    node.AddMappingEntry(0x2000, name="Test", struct=OD.NVAR, size=8, nbmax=4, values=[])
+    node.UserMapping[0x2000]["incr"] = 1
+    node.SetMappingEntry(0x2000, struct=OD.NVAR)
+    assert node.GetBaseIndex(0x2002) == 0x2000
+
+    node.RemoveMappingEntry(0x2000)
+    assert node.GetBaseIndex(0x2002) is None
+
+
+def test_node_entry_cache(basepath):
+
+    node = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master.od'))
+
+    infos = node.GetEntryInfos(0x1000)
+    with pytest.raises(TypeError):
+        infos["name"] = "Modified"
+    assert node.GetEntryInfos(0x1000) == infos
+
+    node.AddMappingEntry(0x2000, name="Test", struct=OD.VAR, size=8, values=[
+        {"name": "Test", "type": 0x05, "access": "rw", "pdo": True}
+    ])
+    assert node.GetEntryName(0x2000) == "Test"
+    assert node.GetSubentryInfos(0x2000, 0)["user_defined"]
+
+    node.SetMappingEntry(0x2000, name="Renamed")
+    assert node.GetEntryName(0x2000) == "Renamed"
+    assert node.GetSubentryInfos(0x2000, 0)["name"] == "Renamed"
+
+    node.RemoveMappingEntry(0x2000)
+    assert node.GetEntryName(0x2000) is None
+    assert node.GetEntryInfos(0x2000) is None
+
+    profile = dict(node.Profile)
+    profile[0x2000] = {"name": "Profile", "struct": OD.VAR, "need": False, "values": [
+        {"name": "Profile", "type": 0x05, "access": "rw", "pdo": True}
+    ]}
+    node.Profile = profile
+    assert node.GetEntryName(0x2000) == "Profile"
+
+
+def test_stringformat():
+
+    assert StringFormat("Test", 1, 2) == "Test"
+    assert StringFormat("Test %d[(sub)]", 1, 2) == "Test 2"
+    assert StringFormat("Test %d %d[(idx,sub)]", 1, 2) == "Test 1 2"
+    assert StringFormat("Test 0x%X to 0x%X[(sub*8-7,sub*8)]", 1, 2) == "Test 0x9 to 0x10"
+    assert StringFormat("Test %d[((idx-1)*128+sub)]", 2, 3) == "Test 131"
+    assert StringFormat("Test %d[( sub - 3)]", 1, 5) == "Test 2"
+    assert StringFormat("Test %d[(-sub // 2 % 7)]", 1, 5) == "Test 4"
+
+    with pytest.raises(ValueError):
+        StringFormat("Test %s[(__import__('os'))]", 1, 2)
+    with pytest.raises(ValueError):
+        StringFormat("Test %d[(sub**2)]", 1, 2)
+
+
+def test_stringformat_profiles(profile):
+
+    for name in ('DS-302', 'DS-401', 'DS-402', 'DS-404', 'DS-406', 'DS-408', 'DS-410', 'DS-418', 'DS-419', 'Test'):
+        mapping, _ = objdictgen.ImportProfile(name)
+        for entry in list(mapping.values()) + list(maps.MAPPING_DICTIONARY.values()):
+            for text in [entry["name"]] + [v["name"] for v in entry["values"]]:
+                match = RE_NAME.match(text)
+                for idx, sub in ((1, 0), (1, 1), (3, 7), (12, 254)):
+                    expected = match.group(1) % eval(match.group(2)) if match else text
+                    assert StringFormat(text, idx, sub) == expected
+
+
+def test_compilevalue():
+
+    node = objdictgen.Node(id=0x12)
+
+    values = (
+        '"$NODEID+0x180"', "'$NODEID+0x180'", '"$nodeid + 384"', '"$NODEID"', '"$NODEID-0x10"',
+        '{True:"$NODEID+0x%X00"%(base+2),False:0x80000000}[base<4]',
+        '{True:"$NODEID+0x%X80"%(base+1),False:0x80000000}[base<4]',
+        '"$NODEID+0x180+1"', '"0x180+$NODEID"',
+    )
+    for value in values:
+        for index in (0x1400, 0x1403, 0x1404, 0x1800, 0x1805):
+            base = node.GetBaseIndexNumber(index)  # noqa: F841  pylint: disable=unused-variable
+            for compute in (True, False):
+                expected = eval(value)  # pylint: disable=eval-used
+                if compute and isinstance(expected, str):
+                    expected = eval(expected.upper().replace("$NODEID", "node.ID"))  # pylint: disable=eval-used
+                assert node.CompileValue(value, index, compute) == expected
+
+    with pytest.raises(ValueError):
+        node.CompileValue('"$NODEID+"', 0x1400)
+
+
+def test_compilevalues(basepath):
+
+    node = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master.od'))
+    node.ID = 0x10
+    expected = {index: node.GetEntry(index) for index in node.Dictionary}
+
+    node.ID = 0x20
+    values = node.CompileValues(0x10)
+    for index, value in values.items():
+        if isinstance(value, list):
+            assert [len(value)] + value == expected[index]
+        else:
+            assert value == expected[index]
+
+
+def test_type_registry(basepath):
+
+    node = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master.od'))
+
+    assert node.GetTypeIndex("UNSIGNED8") == 0x05
+    assert node.GetTypeName(0x05) == "UNSIGNED8"
+    assert node.GetTypeDefaultValue(0x05) == 0
+    assert node.GetTypeIndex("INTEGER8[0-100]") is None
+
+    node.AddMappingEntry(0xA0, name="INTEGER8[0-100]", struct=OD.RECORD, size=8, default=0)
+    assert node.GetTypeIndex("INTEGER8[0-100]") == 0xA0
+    assert node.GetTypeName(0xA0) == "INTEGER8[0-100]"
+
+    node.RemoveMappingEntry(0xA0)
+    assert node.GetTypeIndex("INTEGER8[0-100]") is None
+    assert node.GetTypeName(0xA0) is None
+
+
+def test_copy(basepath):
+
+    node = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master-ds302-ds401.od'))
+    dump = copy.deepcopy(node.__dict__)
+
+    other = node.Copy()
+    assert other.__dict__ == node.__dict__
+    assert other.Profile is node.Profile
+    assert other.DS302 is node.DS302
+
+    index = next(i for i in other.Dictionary if isinstance(other.Dictionary[i], list))
+    other.SetEntry(index, 1, 42)
+    other.SetParamsEntry(index, 1, comment="Modified")
+    other.AddMappingEntry(0x2000, name="Test", struct=OD.VAR, size=8, values=[
+        {"name": "Test", "type": 0x05, "access": "rw", "pdo": True}
+    ])
+    for i in list(other.Profile)[:2] + list(other.DS302)[:2]:
+        other.RemoveIndex(i)
+
+    assert node.__dict__ == dump
+
+
+def test_compact(odfile):
+
+    with open(odfile + '.od', 'r') as f:
+        m0 = nosis.xmlload(f)
+    m1 = copy.deepcopy(m0)
+    m1.Compact()
+    assert m1.__dict__ == m0.__dict__
+
+    for mapping in (m1.Profile, m1.DS302, m1.UserMapping):
+        names = {}
+        for entry in mapping.values():
+            for value in entry["values"]:
+                assert names.setdefault(value["name"], value["name"]) is value["name"]
+
+
+def test_compact_load(odfile):
+
+    node = objdictgen.LoadFile(odfile + '.json')
+
+    # Equal strings and integers found in different indexes must be the same
+    # objects after loading
+    seen = {}
+    shared = set()
+
+    def walk(index, obj):
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                walk(index, k)
+                walk(index, v)
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(index, v)
+        elif isinstance(obj, (str, int)) and not isinstance(obj, bool):
+            first_index, first = seen.setdefault((type(obj), obj), (index, obj))
+            assert first is obj
+            if first_index != index:
+                shared.add((type(obj), obj))
+
+    for name in ("Dictionary", "ParamsDictionary", "UserMapping"):
+        for index, data in getattr(node, name).items():
+            walk(index, data)
+    assert shared
+
+
+def test_shared_profiles(basepath):
+
+    mapping, menu = objdictgen.ImportProfile('DS-401')
+    assert objdictgen.ImportProfile('DS-401')[0] is mapping
+    assert objdictgen.ImportProfile('DS-401')[1] is not menu
+
+    m1 = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master-ds302-ds401.od'))
+    m2 = objdictgen.LoadFile(os.path.join(basepath, 'tests', 'od', 'master-ds302-ds401.od'))
+    assert isinstance(m1.DS302, ProfileMapping)
+    assert m1.DS302 is m2.DS302
+    assert m1.DS302 == objdictgen.ImportProfile('DS-302')[0]
+    assert m1.Profile == mapping
+    assert jsonod.compare_profile('DS-401', m1.Profile, m1.SpecificMenu) == (True, True)
+
+    # The nodes can't modify the shared profile through the entries or menus
+    index = next(iter(m1.DS302))
+    m1.DS302[index]['values'][0]['name'] = 'Modified'
+    m1.GetIndexDict(index, share=True)['ds302']['name'] = 'Modified'
+    menu.append(('Modified', []))
+    profile302 = objdictgen.ImportProfile('DS-302')[0]
+    assert m2.DS302[index]['values'][0]['name'] != 'Modified'
+    assert profile302[index]['name'] != 'Modified'
+    assert objdictgen.ImportProfile('DS-401')[1] != menu
+
+    # Modifications must not touch the shared profile
+    shared = m1.DS302
+    m1.RemoveIndex(index)
+    assert index not in m1.DS302
+    assert index in m2.DS302
+    assert m2.DS302 is shared
+    assert shared == profile302
+
+
+def test_shared_profiles_order():
+
+    mapping, _ = objdictgen.ImportProfile('DS-302')
+    node = objdictgen.Node()
+    node.DS302 = dict(mapping.items())
+    node.ShareProfiles()
+    assert node.DS302 is mapping
+
+    # Equal mappings with another order of the entry members are kept
+    index = next(iter(mapping))
+    entry = mapping[index]
+    node.DS302 = dict(mapping.items())
+    node.DS302[index] = dict(reversed(list(entry.items())))
+    assert node.DS302 == mapping
+    node.ShareProfiles()
+    assert isinstance(node.DS302, ProfileMapping)
+    assert node.DS302 is not mapping
+    assert list(node.DS302[index]) == list(reversed(list(entry)))
+
+    # Other data is not shared
+    node.DS302 = dict(mapping.items())
+    node.DS302[index] = dict(entry, name='Modified')
+    node.ShareProfiles()
+    assert not isinstance(node.DS302, ProfileMapping)
+
+
+def test_profile_cache(oddir, tmp_path, monkeypatch):
+
+    profilepath = str(tmp_path / 'Test.prf')
+    with open(os.path.join(oddir, 'Test.prf'), 'r') as f:
+        text = f.read()
+    with open(profilepath, 'w') as f:
+        f.write(text)
+
+    cachedir = tmp_path / 'cache'
+    monkeypatch.setattr(objdictgen, 'PROFILE_CACHE_DIRECTORY', str(cachedir))
+    mapping, menu = objdictgen.ImportProfile(profilepath)
+    assert objdictgen.ImportProfile(profilepath)[0] is mapping
+    assert len(os.listdir(str(cachedir))) == 1
+
+    # Profiles must be loaded from the cache file without evaluating them
+    def execprofile(path):
+        raise AssertionError("Profile evaluated")
+    monkeypatch.setattr(objdictgen.node, 'PROFILES', {})
+    monkeypatch.setattr(objdictgen.node, 'ExecProfile', execprofile)
+    other, othermenu = objdictgen.ImportProfile(profilepath)
+    assert other is not mapping
+    assert (other, othermenu) == (mapping, menu)
+
+    # Changing the profile must invalidate both caches
+    monkeypatch.undo()
+    monkeypatch.setattr(objdictgen, 'PROFILE_CACHE_DIRECTORY', str(cachedir))
+    with open(profilepath, 'w') as f:
+        f.write(text.replace('Software position limit', 'Modified', 1) + "\n")
+    changed, _ = objdictgen.ImportProfile(profilepath)
+    assert changed != mapping
+
+
+def test_json_profile(oddir, tmp_path, monkeypatch):
+
+    mapping, menu = objdictgen.ImportProfile(os.path.join(oddir, 'Test.prf'))
+    with open(str(tmp_path / 'Test.prf.json'), 'w') as f:
+        f.write(jsonod.GenerateProfileJson(mapping, [("Menu", [0x5000, 0x5100])], name='Test'))
+
+    # The JSON profile is preferred over the .prf profile
+    monkeypatch.setattr(objdictgen, 'PROFILE_DIRECTORIES', [str(tmp_path), oddir])
+    other, othermenu = objdictgen.ImportProfile('Test')
+    assert other == mapping
+    assert list(other) == list(mapping)
+    assert othermenu == [("Menu", [0x5000, 0x5100])]
+
+    with open(str(tmp_path / 'Test.prf.json'), 'w') as f:
+        f.write(jsonod.GenerateProfileJson(mapping, menu).replace('"UNSIGNED8"', '"UNKNOWN"'))
+    with pytest.raises(ValueError):
+        objdictgen.ImportProfile('Test')
+
+
+def test_profile_mapping(profile):
+
+    profile, _ = objdictgen.ImportProfile('DS-408')
+    assert isinstance(profile, ProfileMapping)
+    mapping = ProfileMapping.FromMapping(dict(profile))
+    index = next(i for i in mapping if i >= 0x6000)
+    assert index in mapping and index - 1 not in mapping
+
+    node = objdictgen.Node(profilename='DS-408', profile=mapping)
+    assert node.GetBaseIndex(index) == index
+    assert node.GetEntryName(index) == mapping[index]["name"]
+    assert set(node.GetAllParameters()) == set(mapping)
+
+    # The shared entries can't be modified through the mapping or the nodes
+    other = objdictgen.Node(profilename='DS-408', profile=mapping)
+    with pytest.raises(TypeError):
+        node.Profile[index] = {}
+    node.Profile[index]['values'][0]['name'] = 'Modified'
+    node.GetIndexDict(index, share=True)['profile']['name'] = 'Modified'
+    assert other.Profile[index] == profile[index]
+    assert mapping == profile
+
+    # Copies are ordinary dicts
+    other = copy.copy(mapping)
+    assert isinstance(other, dict)
+    assert other == mapping and mapping == other
+    assert copy.deepcopy(mapping) == mapping
+    other.pop(index)
+    assert other != mapping
+    assert index in mapping
+    assert mapping == profile
+
+
+def test_profile_mapping_lookups(profile):
+
+    class CountingMapping(ProfileMapping):
+        lookups = 0
+
+        def __getitem__(self, index):
+            CountingMapping.lookups += 1
+            return ProfileMapping.__getitem__(self, index)
+
+    profile, _ = objdictgen.ImportProfile('DS-401')
+    mapping = CountingMapping(profile.Entries, profile.Table)
+    for index in mapping:
+        if mapping[index]["struct"] & OD.Subindex:
+            break
+
+    # Each subentry lookup unpacks the entry once
+    CountingMapping.lookups = 0
+    for subindex in range(3):
+        infos = Find.SubentryInfos(index, subindex, mapping)
+        assert infos == Find.SubentryInfos(index, subindex, profile)
+    assert CountingMapping.lookups == 3
+
+
+def test_schema_validator():
+
+    validator = jsonod.get_schema_validator(objdictgen.JSON_SCHEMA)
+    assert jsonod.get_schema_validator(objdictgen.JSON_SCHEMA) is validator
+
+    validator({"$id": "od data", "$version": "1", "name": "", "description": "",
+               "type": "slave", "dictionary": []})
+    with pytest.raises(Exception):
+        validator({"$id": "od data", "$version": "1", "name": "", "description": "",
+                   "type": "unknown", "dictionary": []})
+
+
+def test_schema_validator_changed(tmp_path):
+
+    schemafile = str(tmp_path / 'schema.json')
+    with open(schemafile, 'w') as f:
+        f.write('{"type": "object"}')
+    validator = jsonod.get_schema_validator(schemafile)
+    assert jsonod.get_schema_validator(schemafile) is validator
+    validator({})
+
+    # The validator is compiled again when the file is changed
+    with open(schemafile, 'w') as f:
+        f.write('{"type": "array"}')
+    os.utime(schemafile, (0, 0))
+    other = jsonod.get_schema_validator(schemafile)
+    assert other is not validator
+    other([])
+    with pytest.raises(Exception):
+        other({})
+
+
+def test_schema_validator_fastjsonschema(monkeypatch):
+
+    compiled = []
+
+    def compile_schema(schema):
+        if schema.get('title') == 'Unsupported':
+            raise ValueError("Unsupported schema")
+        compiled.append(schema)
+        return lambda data: data
+
+    monkeypatch.setitem(sys.modules, 'fastjsonschema', types.SimpleNamespace(compile=compile_schema))
+    monkeypatch.setattr(jsonod, 'SCHEMA_VALIDATORS', {})
+
+    validator = jsonod.get_schema_validator(objdictgen.JSON_SCHEMA)
+    assert jsonod.get_schema_validator(objdictgen.JSON_SCHEMA) is validator
+    assert len(compiled) == 1
+    assert validator({"a": 1}) == {"a": 1}
+
+    # Schemas fastjsonschema can't compile are validated with jsonschema
+    monkeypatch.setattr(jsonod, 'SCHEMA_VALIDATORS', {})
+    monkeypatch.setattr(jsonod, 'remove_jasonc', lambda text: '{"title": "Unsupported", "type": "object"}')
+    validator = jsonod.get_schema_validator(objdictgen.JSON_SCHEMA)
+    assert len(compiled) == 1
+    validator({})
+    with pytest.raises(Exception):
+        validator([])
@@ -1,5 +1,9 @@
 from pprint import pprint
 import os
+import copy
+import pytest
+from objdictgen.node import Node
+from objdictgen.maps import OD
 from objdictgen.nodemanager import NodeManager
 
 
@@ -21,3 +25,106 @@ def test_load(basepath):
 
     m1 = NodeManager()
     m1.OpenFileInCurrent(os.path.join(basepath, 'tests', 'od', 'master.od'))
+
+
+def test_undo(basepath):
+
+    m1 = NodeManager()
+    m1.OpenFileInCurrent(os.path.join(basepath, 'tests', 'od', 'master-ds302-ds401.od'))
+
+    states = [m1.CurrentNode.Copy()]
+
+    m1.ManageEntriesOfCurrent([0x1003, 0x1017], [])
+    states.append(m1.CurrentNode.Copy())
+
+    m1.SetCurrentEntry(0x1017, 0, "1000", "value", "number")
+    states.append(m1.CurrentNode.Copy())
+
+    m1.SetCurrentEntry(0x1017, 0, "A comment", "comment", None)
+    states.append(m1.CurrentNode.Copy())
+
+    m1.AddSubentriesToCurrent(0x1003, 4)
+    states.append(m1.CurrentNode.Copy())
+
+    m1.ManageEntriesOfCurrent([], [0x1017])
+    states.append(m1.CurrentNode.Copy())
+
+    m1.RemoveCurrentVariable(next(iter(m1.CurrentNode.Profile)))
+    m1.BufferCurrentNode()
+    states.append(m1.CurrentNode.Copy())
+
+    assert m1.GetCurrentBufferState() == (True, False)
+    for state in reversed(states[:-1]):
+        m1.LoadCurrentPrevious()
+        assert m1.CurrentNode.__dict__ == state.__dict__
+        assert list(m1.CurrentNode.Dictionary) == list(state.Dictionary)
+    assert m1.GetCurrentBufferState() == (False, True)
+    assert m1.CurrentIsSaved()
+
+    for state in states[1:]:
+        m1.LoadCurrentNext()
+        assert m1.CurrentNode.__dict__ == state.__dict__
+    assert m1.GetCurrentBufferState() == (True, False)
+    assert not m1.CurrentIsSaved()
+
+    # A new change discards the redo history
+    m1.LoadCurrentPrevious()
+    m1.SetCurrentEntry(0x1003, 1, "5", "value", "number")
+    assert m1.GetCurrentBufferState() == (True, False)
+    m1.LoadCurrentPrevious()
+    assert m1.CurrentNode.__dict__ == states[-2].__dict__
+
+
+def test_undo_recorded(basepath, monkeypatch):
+
+    m1 = NodeManager()
+    m1.OpenFileInCurrent(os.path.join(basepath, 'tests', 'od', 'master-ds302-ds401.od'))
+    node = m1.CurrentNode
+
+    states = [node.Copy()]
+
+    # The changes are recorded by the editing methods, so the node must not
+    # be copied by the undo buffer
+    monkeypatch.setattr(Node, "Copy", lambda self: pytest.fail("Node copied"))
+
+    edits = [
+        lambda: m1.AddPDOTransmitToCurrent(),
+        lambda: m1.AddPDOReceiveToCurrent(),
+        lambda: m1.AddMapVariableToCurrent(0x2000, "A", OD.VAR, 0),
+        lambda: m1.AddMapVariableToCurrent(0x2001, "B", OD.ARRAY, 3),
+        lambda: m1.SetCurrentEntry(0x2001, 2, "42", "value", "number"),
+        lambda: m1.SetCurrentEntryName(0x2001, "C"),
+        lambda: m1.AddUserTypeToCurrent(0x04, 0, 100, 0),
+        lambda: m1.SetCurrentUserType(0xA0, 0x04, -10, 10, 0),
+        lambda: m1.SetCurrentNodeInfos("Other", 0x10, "slave", "Changed"),
+        lambda: (m1.RemoveCurrentVariable(0x1800), m1.BufferCurrentNode()),
+        lambda: (m1.RemoveCurrentVariable(0x2000), m1.BufferCurrentNode()),
+        lambda: (m1.RemoveCurrentVariable(0xA0), m1.BufferCurrentNode()),
+    ]
+    for edit in edits:
+        edit()
+        states.append(copy.deepcopy(node))
+
+    for state in reversed(states[:-1]):
+        m1.LoadCurrentPrevious()
+        assert m1.CurrentNode is node
+        assert node.__dict__ == state.__dict__
+        assert list(node.Dictionary) == list(state.Dictionary)
+        assert list(node.UserMapping) == list(state.UserMapping)
+    assert m1.GetCurrentBufferState() == (False, True)
+
+    for state in states[1:]:
+        m1.LoadCurrentNext()
+        assert node.__dict__ == state.__dict__
+        assert list(node.Dictionary) == list(state.Dictionary)
+
+    # A change which isn't buffered is discarded by undo
+    m1.SetCurrentNodeDefaultStringSize(50)
+    m1.LoadCurrentPrevious()
+    assert node.__dict__ == states[-2].__dict__
+
+    # Only the changed indexes are kept in the buffer
+    m1.LoadCurrentNext()
+    m1.SetCurrentEntry(0x1000, 0, "500", "value", "number")
+    buffer = m1.UndoBuffers[m1.NodeIndex]
+    assert buffer.Deltas[-1] == [("Dictionary", 0x1000, None, 0, 500)]
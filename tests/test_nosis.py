@@ -0,0 +1,279 @@
+import os
+import glob
+import re
+import random
+import threading
+from xml.etree import ElementTree
+from xml.sax.saxutils import unescape
+from io import StringIO
+import pytest
+import objdictgen
+from objdictgen.nosis import pickle as nosis
+from objdictgen.nosis import xtoy
+
+
+def _unsafe_string_exec(s):
+    """ Reference implementation of xtoy.unsafe_string() """
+    ns = {}
+    exec("s='" + s.replace("'", r"\047") + "'", ns)
+    return ns['s']
+
+
+def _aton_regex(s):
+    """ Reference implementation of xtoy.aton() """
+    s = s.strip()
+    while s[0] == '(' and s[-1] == ')':
+        s = s[1:-1]
+    if re.match(xtoy.re_zero, s):
+        return 0
+    if re.match(xtoy.re_float, s):
+        return float(s)
+    if re.match(xtoy.re_long, s):
+        return int(s.rstrip('lL'))
+    if re.match(xtoy.re_int, s):
+        return int(s)
+    m = re.match(xtoy.re_hex, s)
+    if m:
+        n = int(m.group(3), 16)
+        return -n if m.group(1) == '-' else n
+    m = re.match(xtoy.re_oct, s)
+    if m:
+        n = int(m.group(3), 8)
+        return -n if m.group(1) == '-' else n
+    if re.match(xtoy.re_complex, s):
+        return complex(s)
+    if re.match(xtoy.re_complex2, s):
+        r, i = s.split(':')
+        return complex(float(r), float(i))
+    raise ValueError("Invalid string '%s' passed to to_number()'d" % s)
+
+
+def _numeric_values(fnames):
+    """ Return the numeric values in the od files """
+    values = []
+    for fname in fnames:
+        for elem in ElementTree.parse(fname).iter():
+            if elem.get('type') == 'numeric':
+                values.append(elem.get('value', elem.text))
+    return values
+
+
+def _result(func, *args):
+    try:
+        value = func(*args)
+        return type(value), value
+    except Exception as exc:  # pylint: disable=broad-except
+        return type(exc), None
+
+
+def test_xmlload_stream(basepath):
+
+    fnames = glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.od'), recursive=True)
+    assert fnames
+
+    for fname in fnames:
+        with open(fname, 'r') as f:
+            m1 = nosis.xmlload(f, stream=False)
+        with open(fname, 'r') as f:
+            m2 = nosis.xmlload(f)
+
+        assert type(m1) is type(m2)
+        assert m1.__dict__ == m2.__dict__
+        assert list(m1.__dict__) == list(m2.__dict__)
+        assert repr(m1.__dict__) == repr(m2.__dict__)
+
+
+def test_xmlload_refs():
+
+    node = objdictgen.Node()
+    shared = [1, "two", (3, None)]
+    node.A = shared
+    node.B = {"x": shared, 4: (shared, True)}
+    node.C = {}
+    node.C["self"] = node.C
+    node.D = [False, 1.5, "a'b\\c<d>&"]
+    xml = nosis.xmldump(None, node)
+    assert 'refid=' in xml
+
+    for stream in (False, True):
+        m = nosis.xmlload(StringIO(xml), stream=stream)
+
+        assert m.__dict__.keys() == node.__dict__.keys()
+        assert m.A == shared
+        assert m.B["x"] is m.A
+        assert m.B[4][0] is m.A
+        assert m.B[4][1] is True
+        assert m.C["self"] is m.C
+        assert m.D[:2] == [False, 1.5]
+
+
+def test_xmldump_shared_ids(odfile):
+
+    node = objdictgen.Node()
+    shared = [1, 2]
+    node.A = [shared, [3], {"a": [4]}]
+    node.B = (shared, ())
+    xml = nosis.xmldump(None, node)
+
+    # Only the shared list has an id, and it is referred once
+    assert xml.count(' id=') == 1
+    assert xml.count('refid=') == 1
+    m = nosis.xmlload(StringIO(xml))
+    assert m.__dict__ == node.__dict__
+    assert m.B[0] is m.A[0]
+
+    # The output does not depend on the object identities
+    m1 = objdictgen.Node.LoadFile(odfile + '.od')
+    m2 = objdictgen.Node.LoadFile(odfile + '.od')
+    assert nosis.xmldump(None, m1) == nosis.xmldump(None, m2)
+
+
+def test_xmldump_nested_refs():
+
+    node = objdictgen.Node()
+    shared = {"a": [1]}
+    node.A = {1: [(0, shared)]}
+    node.B = [[[shared["a"]]], shared]
+    xml = nosis.xmldump(None, node)
+    assert xml.count(' id=') == 2
+
+    m = nosis.xmlload(StringIO(xml))
+    assert m.__dict__ == node.__dict__
+    assert m.B[1] is m.A[1][0][1]
+    assert m.B[0][0][0] is m.B[1]["a"]
+
+    # Containers can only be shared through containers, as nested
+    # instances are not pickled
+    node.C = objdictgen.Node()
+    with pytest.raises(ValueError, match="Non-handled type"):
+        nosis.xmldump(None, node)
+
+
+def test_xmldump_threads(odfile):
+
+    m1 = objdictgen.Node.LoadFile(odfile + '.od')
+    expected = nosis.xmldump(None, m1)
+    results = []
+
+    def _dump():
+        for _ in range(5):
+            results.append(nosis.xmldump(None, m1))
+            nosis.xmlload(StringIO(expected))
+
+    threads = [threading.Thread(target=_dump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [expected] * 20
+
+
+class _WriteRecorder(object):
+    """ File object recording the size of the writes """
+    def __init__(self):
+        self.data = []
+
+    def write(self, text):
+        self.data.append(text)
+
+
+def test_xmldump_stream(odfile):
+
+    m1 = objdictgen.Node.LoadFile(odfile + '.od')
+    f = _WriteRecorder()
+    assert nosis.xmldump(f, m1) is None
+
+    # The XML is written in fragments, not as whole attributes
+    assert ''.join(f.data) == nosis.xmldump(None, m1)
+    assert max(len(text) for text in f.data) < 1000
+
+    # Deeply nested containers
+    node = objdictgen.Node()
+    node.A = nested = []
+    for i in range(200):
+        nested.append(i)
+        nested.append([])
+        nested = nested[-1]
+    m = nosis.xmlload(StringIO(nosis.xmldump(None, node)))
+    assert m.A == node.A
+
+
+def test_xmlload_errors():
+
+    header = '<?xml version="1.0"?>\n'
+    for xml in (
+        '<PyObject module="node" class="Unknown" id="1"></PyObject>',
+        '<PyObject module="node" class="Node" id="1"><foo /></PyObject>',
+        '<PyObject module="node" class="Node" id="1"><attr name="a" type="foo" /></PyObject>',
+        '<PyObject module="node" class="Node" id="1"><attr name="a" family="uniq" type="x" /></PyObject>',
+        '<PyObject module="node" class="Node" id="1"><attr name="a" type="list" refid="2" /></PyObject>',
+    ):
+        for stream in (False, True):
+            with pytest.raises((ValueError, KeyError)):
+                nosis.xmlload(StringIO(header + xml), stream=stream)
+
+
+def test_unsafe_string(basepath):
+
+    texts = set()
+    for fname in glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.od'), recursive=True):
+        for elem in ElementTree.parse(fname).iter():
+            texts.update(elem.attrib.values())
+            texts.add(elem.text or '')
+    assert len(texts) > 100
+
+    rand = random.Random(0)
+    alphabet = list('\\\'"xuUN{}0178aAbfnrtv_ \n') + ['\x00', '\xe6', '\u20ac', '\U0001f600']
+    for _ in range(20000):
+        texts.add(''.join(rand.choice(alphabet) for _ in range(rand.randint(1, 12))))
+
+    for text in texts:
+        # Every string is read back as written
+        written = unescape(xtoy.safe_string(text), {'&quot;': '"', '&apos;': "'"})
+        assert xtoy.unsafe_string(written) == text
+
+        # Parity with evaluating the string as python code
+        try:
+            expected = _unsafe_string_exec(text)
+        except (SyntaxError, ValueError, UnicodeError):
+            continue
+        assert xtoy.unsafe_string(text) == expected, repr(text)
+
+    for text in ('a\\', '\\x1', '\\u12', '\\U0011ffff', '\\N{no such name}'):
+        with pytest.raises(ValueError):
+            xtoy.unsafe_string(text)
+
+
+def test_aton(basepath):
+
+    values = set(_numeric_values(glob.glob(os.path.join(basepath, 'tests', 'od', '**', '*.od'), recursive=True)))
+    assert len(values) > 50
+
+    rand = random.Random(0)
+    alphabet = list('00123456789+-.eExXlLjJ:() _af') + ['\u0661']
+    for _ in range(50000):
+        values.add(''.join(rand.choice(alphabet) for _ in range(rand.randint(1, 8))))
+
+    for value in values:
+        assert _result(xtoy.aton, value) == _result(_aton_regex, value), repr(value)
+
+    values = sorted(values)
+    for _ in range(1000):
+        strings = rand.sample(values, rand.randint(0, 5))
+        expected = _result(lambda: [_aton_regex(s) for s in strings])
+        if expected[1] is not None:
+            assert xtoy.atons(strings) == expected[1]
+    assert xtoy.atons(['1', '-20', '0', '+3']) == [1, -20, 0, 3]
+    assert xtoy.atons(['1', '017', '0x10', '1.5']) == [1, 15, 16, 1.5]
+
+
+def test_aton_legacy(basepath):
+    ''' Compare the number conversion of the legacy-compare ODs '''
+
+    values = _numeric_values(glob.glob(os.path.join(basepath, 'tests', 'od', 'legacy-compare', '*.od')))
+    assert values
+
+    expected = [_aton_regex(s) for s in values]
+    assert [xtoy.aton(s) for s in values] == expected
+    assert xtoy.atons(values) == expected
@@ -7,6 +7,7 @@ from collections import OrderedDict
 import pytest
 
 from objdictgen import Node
+from objdictgen.nosis import pickle as nosis
 
 if sys.version_info[0] >= 3:
     ODict = dict
@@ -84,6 +85,19 @@ def test_load_compare(odfile, suffix):
     assert m1.__dict__ == m2.__dict__
 
 
+def test_odsave_stable(wd, odfile):
+    ''' Test that loading and saving an od file keeps the data as read from
+        the file, including its order.
+    '''
+    with open(odfile + '.od', 'r') as f:
+        expected = nosis.xmldump(None, nosis.xmlload(f), omit=('IndexOrder', ))
+
+    m1 = Node.LoadFile(odfile + '.od')
+    m1.DumpFile(odfile.name + '.od', filetype='od')
+    with open(odfile.name + '.od', 'r') as f:
+        assert f.read() == expected
+
+
 def test_odexport(wd, odfile, fn):
     ''' Test that the od file can be exported to od and that the loaded file
         is equal to the first.
@@ -257,6 +271,51 @@ def test_jsonimport(wd, odfile):
     a, b = shave_equal(m1, m3, ignore=('IndexOrder',))
     assert a == b
 
+    m4 = Node.LoadFile(od + '.json', validate=False)
+
+    a, b = shave_equal(m1, m4, ignore=('IndexOrder',))
+    assert a == b
+
+
+def test_odbimport(wd, odfile):
+    ''' Test that the binary od snapshot is read back identical.
+        L(od) -> S(odb), od == L(odb)
+    '''
+    od = odfile.name
+
+    m1 = Node.LoadFile(odfile + '.od')
+    m1.DumpFile(od + '.odb', filetype='odb')
+
+    m2 = Node.LoadFile(od + '.odb')
+
+    assert m1.__dict__ == m2.__dict__
+    assert list(m1.__dict__) == list(m2.__dict__)
+
+    with open(od + '.odb', 'rb') as f:
+        data = f.read()
+
+    # Detect changes to the file
+    with open(od + '.odb', 'wb') as f:
+        f.write(data[:-1] + bytes(bytearray([data[-1] ^ 1])))
+    with pytest.raises(ValueError, match="checksum"):
+        Node.LoadFile(od + '.odb')
+
+    with open(od + '.odb', 'wb') as f:
+        f.write(data[:8] + b'\xff' + data[9:])
+    with pytest.raises(ValueError, match="version"):
+        Node.LoadFile(od + '.odb')
+
+
+def test_odb_legacy(wd, oddir, profile):
+    ''' Test that the legacy-compare ODs are read back identical from the
+        binary od snapshot.
+    '''
+    for name in ('master', 'slave', 'minimal', 'jsontest'):
+        m1 = Node.LoadFile(os.path.join(oddir, 'legacy-compare', name + '.od'))
+        m1.DumpFile(name + '.odb', filetype='odb')
+        m2 = Node.LoadFile(name + '.odb')
+        assert m1.__dict__ == m2.__dict__
+
 
 def test_od_json_compare(odfile):
     ''' Test reading the od and compare it with the corresponding json file
@@ -301,7 +360,7 @@ PROFILE_ODS = [
 ]
 
 @pytest.mark.parametrize("oddut", PROFILE_ODS)
-@pytest.mark.parametrize("suffix", ['od', 'json'])
+@pytest.mark.parametrize("suffix", ['od', 'json', 'odb'])
 def test_save_wo_profile(oddir, oddut, suffix, wd):
     ''' Test that saving a od that contains a profile creates identical
         results as the original. This test has no access to the profile dir
@@ -319,7 +378,7 @@ def test_save_wo_profile(oddir, oddut, suffix, wd):
 
 
 @pytest.mark.parametrize("oddut", PROFILE_ODS)
-@pytest.mark.parametrize("suffix", ['od', 'json'])
+@pytest.mark.parametrize("suffix", ['od', 'json', 'odb'])
 def test_save_with_profile(oddir, oddut, suffix, wd, profile):
     ''' Test that saving a od that contains a profile creates identical
         results as the original. This test have access to the profile dir
@@ -1,6 +1,10 @@
 import os
+import sys
+import subprocess
 import pytest
+import objdictgen
 from objdictgen.__main__ import main
+from objdictgen.node import ProfileMapping
 
 
 @pytest.mark.parametrize("suffix", ['.od', '.json', '.eds'])
@@ -27,3 +31,77 @@ def test_odg_list_wprofile(odfile, suffix, profile):
         'list',
         fname
     ))
+
+
+def test_odg_profile(oddir, wd):
+
+    main((
+        'profile',
+        os.path.join(oddir, 'Test.prf'),
+        'Test.prf.json',
+    ))
+
+    mapping, menu = objdictgen.ImportProfile(os.path.join(oddir, 'Test.prf'))
+    assert objdictgen.ImportProfile(os.path.join(wd, 'Test.prf.json')) == (mapping, menu)
+
+
+def test_odg_diff_internal(oddir, wd, capsys):
+
+    fname = os.path.join(oddir, 'master-ds302.od')
+    od = objdictgen.Node.LoadFile(fname)
+    assert isinstance(od.DS302, ProfileMapping)
+    od.RemoveIndex(0x1f20)
+    od.DumpFile('other.json', filetype='json')
+
+    with pytest.raises(SystemExit) as exc:
+        main(('diff', '--internal', fname, 'other.json'))
+    assert exc.value.code == 1
+
+    out = capsys.readouterr().out
+    assert 'Index 0x1f20 (7968)' in out
+    assert 'DS302 only in LEFT' in out
+    assert 'type_changes' not in out
+
+
+def test_odg_novalidate_schema(oddir, wd, capsys):
+
+    with open(os.path.join(oddir, 'minimal.json'), 'r') as f:
+        text = f.read()
+    with open('invalid.json', 'w') as f:
+        f.write(text.replace('"type": "master",', '"type": "master", "unknown": 1,'))
+
+    # The JSON schema is checked also when the OD is not validated
+    with pytest.raises(SystemExit) as exc:
+        main(('diff', '--novalidate', 'invalid.json', os.path.join(oddir, 'minimal.json')))
+    assert exc.value.code == 1
+    assert 'Additional properties are not allowed' in capsys.readouterr().out
+
+
+# Modules which must not be loaded unless they are needed, as odg is invoked
+# many times from build rules where the startup time dominates
+STARTUP_UNUSED_MODULES = ('jsonschema', 'deepdiff', 'objdictgen.eds_utils', 'objdictgen.gen_cfile')
+
+STARTUP_SCRIPT = '''
+import sys
+from objdictgen.__main__ import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+sys.stderr.write("%s\\n" % " ".join(sys.modules))
+'''
+
+
+@pytest.mark.parametrize("args", [('--version',), ('list', 'master.od')])
+def test_odg_startup(oddir, args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(objdictgen.__path__[0])] + sys.path)
+    proc = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT] + [os.path.join(oddir, a) if a.endswith('.od') else a for a in args],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    modules = proc.stderr.splitlines()[-1].split()
+
+    assert 'objdictgen.node' in modules
+    assert not [m for m in STARTUP_UNUSED_MODULES if m in modules]